@@ -1,27 +1,143 @@
+"""
+Index the locations of every word of a text file, with bounded memory.
+
+Prints each word (sorted ignoring case) with its ``(line, column)``
+locations. Locations are kept as flat ``array('I')`` pairs instead of
+lists of tuples. When they pass ``memory_limit`` bytes, the words seen so
+far are written to disk as a sorted run, and at the end the runs are
+merged with ``heapq.merge``, so a file of any size can be indexed. The
+locations of a word are printed a chunk at a time, straight from the
+arrays of each run, so not even the most common word is held whole:
+
+    $ python example_4.py big.log 256  # MB of locations kept in memory
+"""
+import heapq
+import itertools
+import mmap
 import re
+import struct
 import sys
+import tempfile
+from array import array
+from collections.abc import Iterable, Iterator
+from pathlib import Path
 
 WORD_RE = re.compile(r'\w+')
+MEMORY_LIMIT = 64 * 1024 * 1024
+WORD_OVERHEAD = 150  # rough bytes of a new dict entry, its str key and array
+RUN_HEADER = struct.Struct('=II')  # bytes of the word, number of locations
+PRINT_PAIRS = 4096  # locations formatted at a time
+
+Entry = tuple[str, array]  # a word and its locations: line, column, line...
+Merged = tuple[str, list[array]]  # a word and its locations in each run
+
+
+def read_words(path: str | Path) -> Iterator[tuple[str, int, int]]:
+    with open(path, 'rb') as fp:
+        if not fp.seek(0, 2):
+            return  # mmap can't map an empty file
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            line_no = 0
+            for mapped_line in iter(mapped.readline, b''):
+                # readline() only stops at \n, but text mode also ends a line
+                # at a lone \r, and so does bytes.splitlines()
+                for line_no, line in enumerate(mapped_line.splitlines(), line_no + 1):
+                    for match in WORD_RE.finditer(line.decode('utf-8')):
+                        yield match.group(), line_no, match.start() + 1
+
+
+def sort_key(word: str) -> tuple[str, str]:
+    # the word itself after the uppercase keeps its case variants together
+    return word.upper(), word
+
+
+def write_run(index: dict[str, array], path: Path) -> Path:
+    with open(path, 'wb') as fp:
+        for word in sorted(index, key=sort_key):
+            encoded = word.encode('utf-8')
+            fp.write(RUN_HEADER.pack(len(encoded), len(index[word])))
+            fp.write(encoded)
+            index[word].tofile(fp)
+    return path
+
+
+def read_run(path: Path) -> Iterator[Entry]:
+    with open(path, 'rb') as fp:
+        while header := fp.read(RUN_HEADER.size):
+            size, count = RUN_HEADER.unpack(header)
+            word = fp.read(size).decode('utf-8')
+            locations = array('I')
+            locations.fromfile(fp, count)
+            yield word, locations
 
-index = {}
-with open(sys.argv[1], encoding='utf-8') as fp:
-    for line_no, line in enumerate(fp, 1):
-        for match in WORD_RE.finditer(line):
-            word = match.group()
-            column_no = match.start() + 1
-            location = (line_no, column_no)
+
+def merge_runs(runs: list[Iterator[Entry]]) -> Iterator[Merged]:
+    # merge() is stable and the runs are in file order, so the locations
+    # of a word found in several runs stay sorted one run after the other
+    merged = heapq.merge(*runs, key=lambda entry: sort_key(entry[0]))
+    for word, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+        yield word, [run_locations for _, run_locations in entries]
+
+
+def in_first_seen_order(entries: Iterable[Merged]) -> Iterator[Merged]:
+    """Case variants of a word in the order they first appear in the file
+
+    That's the order ``sorted(index, key=str.upper)`` gave, with the dict
+    keeping the words in insertion order.
+    """
+    for _, variants in itertools.groupby(entries, key=lambda entry: entry[0].upper()):
+        yield from sorted(variants, key=lambda entry: (entry[1][0][0], entry[1][0][1]))
+
+
+def index_words(path: str | Path, memory_limit: int = MEMORY_LIMIT) -> Iterator[Merged]:
+    with tempfile.TemporaryDirectory(prefix='word_index_') as directory:
+        runs: list[Path] = []
+        index: dict[str, array] = {}
+        num_locations = 0
+        for word, line_no, column_no in read_words(path):
             # wrong way to do it
             # occurencies = index.get(word, [])
             # occurencies.append(location)
             # index[word] = occurencies
-            
+
             # right way to do it (seems like a gambiarra)
-            index.setdefault(word, []).append(location)
+            index.setdefault(word, array('I')).extend((line_no, column_no))
             # it is the same as
             # if key no in my_dict:
             #     my_dict[key] = []
             # my_dict[key].append(new_value)
             # but with only one search for the key in the dict
+            num_locations += 1
+            if 8 * num_locations + WORD_OVERHEAD * len(index) > memory_limit:
+                runs.append(write_run(index, Path(directory) / f'run_{len(runs)}'))
+                index, num_locations = {}, 0
+
+        if not runs:  # it all fit in memory
+            entries = ((word, [index[word]]) for word in sorted(index, key=sort_key))
+            yield from in_first_seen_order(entries)
+            return
+        if index:
+            runs.append(write_run(index, Path(directory) / f'run_{len(runs)}'))
+        del index
+        yield from in_first_seen_order(merge_runs([read_run(run) for run in runs]))
+
+
+def main(path: str, memory_limit_mb: str | None = None) -> None:
+    memory_limit = int(float(memory_limit_mb) * 1024 * 1024) if memory_limit_mb else MEMORY_LIMIT
+    write = sys.stdout.write
+    for word, runs in index_words(path, memory_limit):
+        # the same text as print(word, list_of_tuples)
+        write(f'{word} [')
+        separator = ''
+        for locations in runs:
+            for start in range(0, len(locations), 2 * PRINT_PAIRS):
+                chunk = locations[start:start + 2 * PRINT_PAIRS]
+                pairs = ', '.join(f'({line_no}, {column_no})' for line_no, column_no
+                                  in zip(chunk[::2], chunk[1::2]))
+                write(separator + pairs)
+                separator = ', '
+        write(']\n')
+
 
-for word in sorted(index, key=str.upper):
-    print(word, index[word])
\ No newline at end of file
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -1,21 +1,74 @@
+import functools
+import json
 import sys
 import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
 
 START, END = ord(' '), sys.maxunicode + 1
+# Saved with --save-index as plain JSON, a word and its code points per entry,
+# so loading it never runs code; a file from another Unicode version is ignored
+INDEX_PATH = Path(__file__).with_name(f'find_char-{unicodedata.unidata_version}.json')
+
+@functools.cache
+def word_index() -> dict[str, array]:
+    """Sorted code points of the characters with each word in their name"""
+    # Built (or loaded) once per process, then every find() is a lookup
+    if (saved := load_index()) is not None:
+        return saved
+    index = defaultdict(lambda: array('I'))
+    for code in range(END):
+        name = unicodedata.name(chr(code), None)
+        if name:
+            for word in set(name.split()):
+                index[word].append(code)
+    return dict(index)
+
+def load_index() -> dict[str, array] | None:
+    try:
+        with open(INDEX_PATH, encoding='utf-8') as fp:
+            saved = json.load(fp)
+        if saved['unidata_version'] != unicodedata.unidata_version:
+            return None
+        return {word: array('I', codes) for word, codes in saved['index'].items()}
+    except (OSError, ValueError, KeyError, TypeError, OverflowError):
+        return None  # missing or damaged: build it again
+
+def save_index():
+    index = word_index()  # before opening the file, which may be its source
+    saved = {'unidata_version': unicodedata.unidata_version,
+             'index': {word: codes.tolist() for word, codes in index.items()}}
+    temporary = INDEX_PATH.with_suffix('.tmp')
+    with open(temporary, 'w', encoding='utf-8') as fp:
+        json.dump(saved, fp, separators=(',', ':'))
+    temporary.replace(INDEX_PATH)
 
 def find(*query_words, start=START, end=END):
     query = {w.upper() for w in query_words}
-    for code in range(start, end):
+    if not query:  # every named character matches
+        codes = (code for code in range(start, end) if unicodedata.name(chr(code), None))
+    else:
+        index = word_index()
+        if not query.issubset(index.keys()):
+            return
+        rarest, *others = sorted((index[w] for w in query), key=len)
+        in_range = rarest[bisect_left(rarest, start):bisect_left(rarest, end)]
+        codes = sorted(set(in_range).intersection(*others))
+    for code in codes:
         char = chr(code)
-        name = unicodedata.name(char, None)
-        if name and query.issubset(name.split()):
-            print(f'U+{code:04X}\t{char}\t{name}')
+        name = unicodedata.name(char)
+        print(f'U+{code:04X}\t{char}\t{name}')
 
 def main(words):
-    if words:
+    if words == ['--save-index']:
+        save_index()
+        print(f'Index saved to {INDEX_PATH}')
+    elif words:
         find(*words)
     else:
         raise RuntimeError('Please provide words to find')
 
 if __name__ == '__main__':
-    main(sys.argv[1:])
\ No newline at end of file
+    main(sys.argv[1:])
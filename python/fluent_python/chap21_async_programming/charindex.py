@@ -2,42 +2,140 @@
 
 """
 Class ``InvertedIndex`` builds an inverted index mapping each word to
-the set of Unicode characters which contain that word in their names.
+the Unicode characters which contain that word in their names.
 
 Optional arguments to the constructor are ``first`` and ``last+1``
 character codes to index, to make testing easier. In the examples
 below, only the ASCII range was indexed.
 
-The `entries` attribute is a `defaultdict` with uppercased single
-words as keys::
+The `entries` attribute is a `dict` with uppercased single words as
+keys. Each value is a posting list: the sorted code points of the
+characters with that word, in an ``array('I')`` which takes 4 bytes per
+character instead of a ``str`` object in a set::
 
     >>> idx = InvertedIndex(32, 128)
     >>> idx.entries['DOLLAR']
-    {'$'}
-    >>> sorted(idx.entries['SIGN'])
+    array('I', [36])
+    >>> [chr(code) for code in idx.entries['SIGN']]
     ['#', '$', '%', '+', '<', '=', '>']
-    >>> idx.entries['A'] & idx.entries['SMALL']
-    {'a'}
-    >>> idx.entries['BRILLIG']
-    set()
+    >>> 'BRILLIG' in idx.entries
+    False
 
 The `.search()` method takes a string, uppercases it, splits it into
-words, and returns the intersection of the entries for each word::
+words, and returns the characters in the entries of every word, in code
+point order. The intersection starts from the shortest posting list and
+binary searches the much longer ones, so a rare word makes the whole
+query cheap::
 
     >>> idx.search('capital a')
-    {'A'}
+    ['A']
+    >>> idx.search('small sign')
+    []
+    >>> intersect([array('I', [1, 5, 9, 12]), array('I', [5, 12]), array('I', [2, 5, 7, 12, 30])])
+    array('I', [5, 12])
+
+With ``mode='prefix'`` each word also matches the longer words starting
+with it, and with ``mode='fuzzy'`` the words one edit (a letter deleted,
+inserted, replaced or two letters swapped) away from it. A single word
+can ask for either with a ``*`` or ``~`` suffix::
+
+    >>> idx.search('dolla', 'prefix')
+    ['$']
+    >>> idx.search('dolar', 'fuzzy')
+    ['$']
+    >>> idx.search('sma* leter~ z')
+    ['z']
+
+A prefix shorter than ``MIN_PREFIX`` letters would union thousands of
+posting lists (``S*`` matches more than 1,500 words), so it only
+matches the word itself::
+
+    >>> idx.search('a*') == idx.search('a')
+    True
+    >>> idx.search('dol*')
+    ['$']
+
+``.ranked()`` scores every character with any of the words, rarer words
+and shorter names scoring higher (BM25, with the length of each name
+and their average counted when the index is built), and returns the
+best ``k`` from a heap instead of sorting all of them::
+
+    >>> [char for char, score in idx.ranked('capital a', 3)]
+    ['A', 'a', 'B']
+
+Building the full index calls ``unicodedata.name`` on every code point,
+which takes seconds. ``save`` writes it to a file: a header, the sorted
+words, the code points of each word packed as ``uint32`` and the length
+of each name as a byte. ``load`` memory-maps that file, so only the word
+table is decoded at startup and each posting list is read when it is
+looked up::
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'ascii.idx')
+    >>> idx.save(path)
+    >>> mapped = InvertedIndex.load(path, 32, 128)
+    >>> list(mapped.entries['SIGN']) == list(idx.entries['SIGN'])
+    True
+    >>> mapped.search('capital a')
+    ['A']
+
+The file records ``unicodedata.unidata_version`` and the range indexed;
+``load`` returns ``None`` when they don't match the running Python, and
+``load_index`` then rebuilds the file. Build it ahead of time with::
+
+    $ python charindex.py --build
+
+Pass ``workers`` to split the code points among that many processes,
+which is what ``--build`` does with one per CPU; the partial indexes
+are merged in code point order::
+
+    >>> InvertedIndex(32, 128, workers=2).entries == idx.entries
+    True
 
 """
 
+import heapq
+import math
+import mmap
+import os
+import struct
 import sys
 import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
-from collections.abc import Iterator
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from string import ascii_uppercase, digits
+from typing import Literal
 
 STOP_CODE: int = sys.maxunicode + 1
 
+INDEX_PATH = Path(__file__).parent / f'charindex-{unicodedata.unidata_version}.idx'
+MAGIC = b'MOJIDX02'
+# magic, unidata_version, start, stop, number of words, size of the word table,
+# number of named characters, number of words in all names
+HEADER = struct.Struct('=8s16sIIIIII')
+# Binary search a posting list this many times longer than the matches so far,
+# below that a set intersection (in C) is faster than bisecting in a loop
+SKEW = 8
+# Characters of the words in Unicode names, to generate the fuzzy variants
+NAME_LETTERS = ascii_uppercase + digits
+# Shorter prefixes are searched as exact words: they expand to too many words
+MIN_PREFIX = 3
+# Shards of the code point range given to each process of a parallel build
+SHARDS_PER_WORKER = 8
+# BM25 parameters: saturation of term frequency and weight of the name length
+K1 = 1.2
+B = 0.75
+MAX_LENGTH = 255  # name lengths are stored as bytes
+
 Char = str
-Index = defaultdict[str, set[Char]]
+Postings = Sequence[int]  # sorted code points
+Index = dict[str, array]
+Mode = Literal['exact', 'prefix', 'fuzzy']
+SUFFIX_MODES: dict[str, Mode] = {'*': 'prefix', '~': 'fuzzy'}
 
 
 def tokenize(text: str) -> Iterator[str]:
@@ -46,28 +144,268 @@ def tokenize(text: str) -> Iterator[str]:
         yield word
 
 
+def parse_words(query: str, mode: Mode) -> Iterator[tuple[str, Mode]]:
+    """Unique words of ``query``, each with the mode of its suffix or ``mode``"""
+    for word in set(tokenize(query)):
+        if word[-1] in SUFFIX_MODES:
+            word, word_mode = word[:-1], SUFFIX_MODES[word[-1]]
+            if word:
+                yield word, word_mode
+        else:
+            yield word, mode
+
+
+def edits(word: str) -> set[str]:
+    """Strings one edit away from ``word``"""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [a + b[1:] for a, b in splits if b]
+    swaps = [a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1]
+    replaces = [a + c + b[1:] for a, b in splits if b for c in NAME_LETTERS]
+    inserts = [a + c + b for a, b in splits for c in NAME_LETTERS]
+    return set(deletes + swaps + replaces + inserts)
+
+
+def union(postings: list[Postings]) -> Postings:
+    if len(postings) == 1:
+        return postings[0]
+    return array('I', sorted(set().union(*postings)))
+
+
+def probe(found: Postings, other: Postings) -> array:
+    """Codes of ``found`` also in the much longer ``other``"""
+    matches = array('I')
+    i = 0
+    for code in found:
+        # codes are sorted, so each search starts where the last one ended
+        i = bisect_left(other, code, i)
+        if i == len(other):
+            break
+        if other[i] == code:
+            matches.append(code)
+    return matches
+
+
+def intersect(postings: list[Postings]) -> Postings:
+    postings = sorted(postings, key=len)
+    found = postings[0]
+    for other in postings[1:]:
+        if len(other) > SKEW * len(found):
+            found = probe(found, other)
+        else:
+            found = array('I', sorted(set(found).intersection(other)))
+        if not found:
+            break
+    return found
+
+
+class MappedEntries(Mapping[str, Postings]):
+    """Read-only ``entries`` backed by the buffer of an index file"""
+
+    def __init__(self, words: list[str], offsets: memoryview, postings: memoryview):
+        self.words = words  # sorted, so lookups bisect instead of building a dict
+        self.offsets = offsets
+        self.postings = postings
+
+    def __getitem__(self, word: str) -> Postings:
+        i = bisect_left(self.words, word)
+        if i == len(self.words) or self.words[i] != word:
+            raise KeyError(word)
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.words)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+def index_range(start: int, stop: int) -> tuple[Index, array]:
+    """Posting lists and name lengths of the code points in ``range(start, stop)``"""
+    entries: defaultdict[str, array] = defaultdict(lambda: array('I'))
+    lengths = array('B')  # words in each name, 0 for unnamed code points
+    for code in range(start, stop):
+        words = list(tokenize(unicodedata.name(chr(code), '')))
+        lengths.append(min(len(words), MAX_LENGTH))
+        # set() because a word can repeat in a name; codes arrive sorted
+        for word in set(words):
+            entries[word].append(code)
+    return dict(entries), lengths
+
+
+def index_parallel(start: int, stop: int, workers: int) -> tuple[Index, array]:
+    """``index_range`` split in shards run by a pool of processes"""
+    # More shards than workers: names are much denser in some ranges
+    num_shards = workers * SHARDS_PER_WORKER
+    bounds = [start + (stop - start) * i // num_shards for i in range(num_shards + 1)]
+    entries: defaultdict[str, array] = defaultdict(lambda: array('I'))
+    lengths = array('B')
+    with ProcessPoolExecutor(workers) as executor:
+        # map yields the shards in order, so each posting list stays sorted
+        for shard, shard_lengths in executor.map(index_range, bounds[:-1], bounds[1:]):
+            for word, codes in shard.items():
+                entries[word].extend(codes)
+            lengths.extend(shard_lengths)
+    return dict(entries), lengths
+
+
 class InvertedIndex:
-    entries: Index
-
-    def __init__(self, start: int = 32, stop: int = STOP_CODE):
-        entries: Index = defaultdict(set)
-        for char in (chr(i) for i in range(start, stop)):
-            name = unicodedata.name(char, '')
-            if name:
-                for word in tokenize(name):
-                    entries[word].add(char)
-        self.entries = entries
-
-    def search(self, query: str) -> set[Char]:
-        if words := list(tokenize(query)):
-            found = self.entries[words[0]]
-            return found.intersection(*(self.entries[w] for w in words[1:]))
+    entries: Mapping[str, Postings]
+
+    def __init__(self, start: int = 32, stop: int = STOP_CODE, workers: int = 1):
+        self.start, self.stop = start, stop
+        if workers > 1:
+            self.entries, self.lengths = index_parallel(start, stop, workers)
         else:
-            return set()
+            self.entries, self.lengths = index_range(start, stop)
+        self.words = sorted(self.entries)
+        self.set_statistics(len(self.lengths) - self.lengths.count(0), sum(self.lengths))
+
+    def set_statistics(self, num_named: int, total_words: int) -> None:
+        self.num_named = num_named
+        self.total_words = total_words
+        # The BM25 length normalization for every possible name length
+        average = total_words / max(num_named, 1)
+        self.length_norms = [(K1 + 1) / (1 + K1 * (1 - B + B * length / average))
+                             for length in range(MAX_LENGTH + 1)]
+
+    def expand(self, word: str, mode: Mode = 'exact') -> list[str]:
+        """Words of the index matched by ``word`` in ``mode``"""
+        if mode == 'prefix' and len(word) >= MIN_PREFIX:
+            # every word starting with ``word`` sorts between it and word + max char
+            lo = bisect_left(self.words, word)
+            hi = bisect_left(self.words, word + chr(sys.maxunicode), lo)
+            return self.words[lo:hi]
+        if mode == 'fuzzy':
+            candidates = edits(word) | {word}
+            return [w for w in candidates if w in self.entries]
+        return [word] if word in self.entries else []
+
+    def find(self, query: str, mode: Mode = 'exact') -> Postings:
+        """Sorted code points of the characters matching ``query``"""
+        postings = []
+        for word, word_mode in parse_words(query, mode):
+            if not (matches := self.expand(word, word_mode)):
+                return array('I')  # no character has that word
+            postings.append(union([self.entries[w] for w in matches]))
+        if not postings:
+            return array('I')
+        return intersect(postings)
+
+    def search(self, query: str, mode: Mode = 'exact') -> list[Char]:
+        return [chr(code) for code in self.find(query, mode)]
+
+    def ranked(self, query: str, k: int = 10,
+               mode: Mode = 'exact') -> list[tuple[Char, float]]:
+        """Best ``k`` characters with any word of ``query``, by BM25 score"""
+        words = set()
+        for word, word_mode in parse_words(query, mode):
+            words.update(self.expand(word, word_mode))
+        scores: defaultdict[int, float] = defaultdict(float)
+        for word in words:
+            codes = self.entries[word]
+            rarity = math.log((self.num_named - len(codes) + 0.5) / (len(codes) + 0.5) + 1)
+            for code in codes:
+                scores[code] += rarity * self.length_norms[self.lengths[code - self.start]]
+        # ties go to the lower code point
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(chr(code), score) for code, score in best]
+
+    def save(self, path: str | Path) -> None:
+        words = sorted(self.entries)
+        word_table = '\n'.join(words).encode('ascii')
+        offsets = array('I', [0])
+        postings = array('I')
+        for word in words:
+            postings.extend(self.entries[word])
+            offsets.append(len(postings))
+        version = unicodedata.unidata_version.encode('ascii')
+        header = HEADER.pack(MAGIC, version, self.start, self.stop,
+                             len(words), len(word_table),
+                             self.num_named, self.total_words)
+        # offsets and postings must start on a 4-byte boundary to cast them
+        padding = b'\0' * (-len(word_table) % 4)
+        # one name per process, several workers may rebuild a stale file at once
+        temporary = Path(f'{path}.{os.getpid()}.tmp')
+        with open(temporary, 'wb') as fp:
+            fp.write(header + word_table + padding)
+            offsets.tofile(fp)
+            postings.tofile(fp)
+            fp.write(self.lengths)
+        temporary.replace(path)  # readers never see a half written file
+
+    @classmethod
+    def load(cls, path: str | Path,
+             start: int = 32, stop: int = STOP_CODE) -> 'InvertedIndex | None':
+        """Index mapped from ``path``, or None if missing or out of date"""
+        try:
+            with open(path, 'rb') as fp:
+                buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):  # ValueError: empty file
+            return None
+        if len(buffer) < HEADER.size:
+            return None
+        (magic, version, file_start, file_stop, num_words, table_size,
+         num_named, total_words) = HEADER.unpack_from(buffer)
+        version_ok = (version.rstrip(b'\0').decode('ascii')
+                      == unicodedata.unidata_version)
+        if (magic, file_start, file_stop) != (MAGIC, start, stop) or not version_ok:
+            return None
+        view = memoryview(buffer)
+        table_end = HEADER.size + table_size
+        words = str(view[HEADER.size:table_end], 'ascii').split('\n')
+        offsets_start = table_end + (-table_size % 4)
+        offsets_end = offsets_start + 4 * (num_words + 1)
+        offsets = view[offsets_start:offsets_end].cast('I')
+        postings_end = offsets_end + 4 * offsets[-1]
+        index = cls.__new__(cls)
+        index.start, index.stop = start, stop
+        index.words = words
+        index.entries = MappedEntries(words, offsets,
+                                      view[offsets_end:postings_end].cast('I'))
+        index.lengths = view[postings_end:postings_end + stop - start]
+        index.set_statistics(num_named, total_words)
+        return index
+
+
+def load_index(path: str | Path = INDEX_PATH, start: int = 32,
+               stop: int = STOP_CODE, workers: int = 1) -> InvertedIndex:
+    """Map the index saved at ``path``, building and saving it first if needed"""
+    index = InvertedIndex.load(path, start, stop)
+    if index is None:
+        index = InvertedIndex(start, stop, workers)
+        index.save(path)
+    return index
+
+
+def page(codes: Postings, limit: int | None,
+         cursor: int | None = None) -> tuple[Postings, int | None]:
+    """Up to ``limit`` codes after ``cursor`` and the cursor of the next page
+
+    The cursor is the last code point of a page, so a page stays right
+    even if the index is rebuilt between requests::
+
+        >>> codes = array('I', [35, 36, 37, 43, 60])
+        >>> page(codes, 2)
+        (array('I', [35, 36]), 36)
+        >>> page(codes, 2, cursor=36)
+        (array('I', [37, 43]), 43)
+        >>> page(codes, 2, cursor=43)
+        (array('I', [60]), None)
+        >>> page(codes, 0)
+        Traceback (most recent call last):
+          ...
+        ValueError: limit must be at least 1, not 0
+    """
+    if limit is not None and limit < 1:
+        raise ValueError(f'limit must be at least 1, not {limit}')
+    start = 0 if cursor is None else bisect_right(codes, cursor)
+    stop = len(codes) if limit is None else min(start + limit, len(codes))
+    next_cursor = codes[stop - 1] if stop < len(codes) else None
+    return codes[start:stop], next_cursor
 
 
-def format_results(chars: set[Char]) -> Iterator[str]:
-    for char in sorted(chars):
+def format_results(chars: Iterable[Char]) -> Iterator[str]:
+    for char in chars:
         name = unicodedata.name(char)
         code = ord(char)
         yield f'U+{code:04X}\t{char}\t{name}'
@@ -77,7 +415,11 @@ def main(words: list[str]) -> None:
     if not words:
         print('Please give one or more words to search.')
         sys.exit(2)  # command line usage error
-    index = InvertedIndex()
+    if words == ['--build']:
+        InvertedIndex(workers=os.cpu_count() or 1).save(INDEX_PATH)
+        print(f'Index written to {INDEX_PATH}')
+        return
+    index = load_index(workers=os.cpu_count() or 1)
     chars = index.search(' '.join(words))
     for line in format_results(chars):
         print(line)
@@ -0,0 +1,167 @@
+"""
+Load generator for the TCP and web mojifinder servers, all on localhost.
+
+Opens ``--connections`` concurrent connections, each sending
+``--queries`` queries picked from ``QUERIES``, one at a time (the next
+after the full reply arrives), and reports the throughput and the
+latency percentiles. HTTP requests are written by hand on keep-alive
+connections, so the client costs little next to the server::
+
+    $ python tcp_mojifinder.py &
+    $ python loadgen.py tcp --port 2323
+    $ uvicorn web_mojifinder:app --port 8000 &
+    $ python loadgen.py http --port 8000 --server-pid $!
+
+It also times building and loading the index in this process, and
+reports its RSS, plus the RSS of the server if ``--server-pid`` is given
+(read from ``/proc``, so Linux only).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from charindex import InvertedIndex
+
+QUERIES = [
+    'cat face', 'arrow', 'heart', 'black star', 'chess', 'smil*', 'hert~',
+    'latin small letter a', 'greek capital', 'face with', 'box drawings',
+    'hiragana', 'moon', 'brillig',
+]
+STATUS_MARK = '─'.encode()  # first bytes of the TCP status line
+
+
+async def tcp_client(host: str, port: int, queries: list[str],
+                     latencies: list[float]) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readuntil(b'?> ')
+    for query in queries:
+        start = time.perf_counter()
+        writer.write(query.encode() + b'\r\n')
+        while not (await reader.readline()).startswith(STATUS_MARK):
+            pass
+        latencies.append(time.perf_counter() - start)
+        await reader.readuntil(b'?> ')
+    writer.close()
+    await writer.wait_closed()
+
+
+async def http_client(host: str, port: int, queries: list[str],
+                      latencies: list[float]) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    for query in queries:
+        request = (f'GET /search?q={quote(query)} HTTP/1.1\r\n'
+                   f'Host: {host}:{port}\r\n\r\n')
+        start = time.perf_counter()
+        writer.write(request.encode())
+        status = await reader.readline()
+        if not status.startswith(b'HTTP/1.1 200'):
+            raise RuntimeError(f'{query!r}: {status.decode().strip()}')
+        length = 0
+        while (line := await reader.readline()) != b'\r\n':
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_load(protocol: str, host: str, port: int, connections: int,
+                   queries_per_connection: int, seed: int) -> dict:
+    client = tcp_client if protocol == 'tcp' else http_client
+    rng = random.Random(seed)
+    latencies: list[float] = []
+    clients = [
+        client(host, port, rng.choices(QUERIES, k=queries_per_connection), latencies)
+        for _ in range(connections)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'protocol': protocol,
+        'connections': connections,
+        'queries': len(latencies),
+        'seconds': elapsed,
+        'queries_per_second': len(latencies) / elapsed,
+        'p50_ms': 1000.0 * percentile(latencies, 50),
+        'p95_ms': 1000.0 * percentile(latencies, 95),
+        'p99_ms': 1000.0 * percentile(latencies, 99),
+    }
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Nearest-rank percentile"""
+    rank = max(0, round(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def rss_mb(pid: int | str = 'self') -> float:
+    for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def index_stats() -> dict:
+    start = time.perf_counter()
+    index = InvertedIndex()
+    build = time.perf_counter() - start
+    # ru_maxrss is in kB on Linux
+    stats = {'build_s': build, 'words': len(index.entries),
+             'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'index.idx'
+        index.save(path)
+        del index
+        start = time.perf_counter()
+        InvertedIndex.load(path)
+        stats['load_s'] = time.perf_counter() - start
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test a mojifinder server')
+    parser.add_argument('protocol', choices=('tcp', 'http'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=200, help='per connection')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--server-pid', type=int, help='report the RSS of this process')
+    parser.add_argument('--skip-index', action='store_true', help="don't time the index build")
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+    port = args.port or (2323 if args.protocol == 'tcp' else 8000)
+
+    results = asyncio.run(run_load(args.protocol, args.host, port,
+                                   args.connections, args.queries, args.seed))
+    if args.server_pid:
+        results['server_rss_mb'] = rss_mb(args.server_pid)
+    if not args.skip_index:
+        results['index'] = index_stats()
+    for name, value in results.items():
+        if isinstance(value, dict):
+            value = ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                              for k, v in value.items())
+        elif isinstance(value, float):
+            value = f'{value:.3f}'
+        print(f'{name:<20}{value}')
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+        print(f'\nResults written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Pre-fork TCP mojifinder: one process per core, all on the same port.
+
+The parent builds the index file once (or finds it up to date), then
+starts the workers. Each worker maps that file read-only, so the OS
+keeps a single copy of the index in the page cache however many workers
+there are, and binds its own listening socket with ``SO_REUSEPORT``,
+letting the kernel spread new connections across the workers.
+
+    $ python prefork_mojifinder.py 127.0.0.1 2323 4
+
+The web version gets the same sharing from ``load_index``, just start it
+with several workers: ``uvicorn web_mojifinder:app --workers 4``.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+import socket
+import sys
+from pathlib import Path
+
+from charindex import INDEX_PATH, InvertedIndex, load_index
+from querycache import QueryCache
+from tcp_mojifinder import finder, start_logging
+
+
+def make_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+async def serve(index: InvertedIndex, cache: QueryCache, sock: socket.socket) -> None:
+    server = await asyncio.start_server(
+        functools.partial(finder, index, cache), sock=sock
+    )
+    await server.serve_forever()
+
+
+def worker(path: Path, host: str, port: int) -> None:
+    index = InvertedIndex.load(path)
+    if index is None:  # replaced by a Python with other Unicode data?
+        print(f'Worker {os.getpid()}: no index at {path}')
+        return
+    cache = QueryCache()
+    sock = make_socket(host, port)
+    listener = start_logging()
+    try:
+        asyncio.run(serve(index, cache, sock))
+    except KeyboardInterrupt:
+        print(f'Worker {os.getpid()} {cache.summary()}')
+    finally:
+        listener.stop()
+
+
+def main(host: str = '127.0.0.1', port_arg: str = '2323',
+         workers_arg: str | None = None) -> None:
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print('SO_REUSEPORT is not available on this platform.')
+        sys.exit(1)
+    port = int(port_arg)
+    num_workers = int(workers_arg) if workers_arg else os.cpu_count() or 1
+    print('Loading index.')
+    # build it once here (with every core), not in every worker
+    load_index(INDEX_PATH, workers=os.cpu_count() or 1)
+    workers = [
+        multiprocessing.Process(target=worker, args=(INDEX_PATH, host, port))
+        for _ in range(num_workers)
+    ]
+    for process in workers:
+        process.start()
+    print(f'Serving on {(host, port)} with {num_workers} workers. Hit CTRL-C to stop.')
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        # the workers got the same SIGINT from the terminal
+        for process in workers:
+            process.join()
+        print('\nServer shut down')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,74 @@
+"""
+Bounded LRU cache of query results for the mojifinder servers.
+
+Keys are normalized queries, plus whatever else changes the reply (like
+the page requested), so ``cat face``, ``Face  CAT`` and ``face-cat``
+share one entry. Values are whatever the server sends back, already
+encoded, so a repeated query doesn't touch the index::
+
+    >>> cache = QueryCache(maxsize=2)
+    >>> key = normalize('cat face')
+    >>> key == normalize('Face  CAT') == normalize('face-cat')
+    True
+    >>> cache.get(key) is None
+    True
+    >>> cache.put(key, b'...')
+    >>> cache.get(normalize('face cat'))
+    b'...'
+    >>> cache.put(normalize('dog'), b'.')
+    >>> cache.put(normalize('heart'), b'.')  # evicts the oldest, cat face
+    >>> len(cache), normalize('cat face') in cache
+    (2, False)
+    >>> cache.summary()
+    'cache: 2 entries, 1 hits, 1 misses (50% hit rate)'
+
+"""
+
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+from charindex import Mode, tokenize
+
+CACHE_SIZE = 1024
+
+def normalize(query: str, mode: Mode = 'exact') -> tuple[str, str]:
+    """Key for the results of ``query``: the mode and its sorted unique words"""
+    return mode, ' '.join(sorted(set(tokenize(query))))
+
+
+class QueryCache:
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Cached value for ``key`` or None, marking it as recently used"""
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)  # least recently used
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (f'cache: {len(self)} entries, {self.hits} hits, '
+                f'{self.misses} misses ({rate:.0%} hit rate)')
@@ -1,5 +1,10 @@
+import logging
+import os
+import queue
 import sys
-from charindex import InvertedIndex, format_results
+from logging.handlers import QueueHandler, QueueListener
+from charindex import InvertedIndex, format_results, load_index, page
+from querycache import QueryCache, normalize
 import asyncio
 import functools
 from typing import cast
@@ -7,48 +12,140 @@ from asyncio.trsock import TransportSocket
 
 CRLF = b'\r\n'
 PROMPT = b'?> '
+# e.g. "letter limit=50 cursor=930", or "cat top=10" for the 10 best ranked
+OPTIONS = ('limit', 'cursor', 'top')
+BATCH_LINES = 256  # lines encoded at a time
+MAX_CACHED_RESULTS = 1000  # longer replies would crowd the cache
+READ_SIZE = 64 * 1024
+MAX_LINE = 64 * 1024  # the limit readline() had
+HIGH_WATER = 64 * 1024  # flush a reply early once this much is buffered
+
+log = logging.getLogger('mojifinder')
+
+
+def start_logging() -> QueueListener:
+    """Send the log through a queue, so a slow stderr never blocks the event loop"""
+    # A second call reuses the queue: another handler would log every line twice
+    handler = next((h for h in log.handlers if isinstance(h, QueueHandler)), None)
+    if handler is None:
+        handler = QueueHandler(queue.SimpleQueue())
+        log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    listener = QueueListener(handler.queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    return listener
+
+
+async def flush(writer: asyncio.StreamWriter, out: bytearray) -> None:
+    # bytes() because the transport may keep a view of what it is given
+    writer.write(bytes(out))
+    out.clear()
+    await writer.drain()
+
 
 async def finder(index: InvertedIndex,
+                 cache: QueryCache,
                  reader: asyncio.StreamReader, # Question: why define this if it's not used by the server?
                  writer: asyncio.StreamWriter) -> None: 
     client = writer.get_extra_info('peername')
-    while True:
-        writer.write(PROMPT) # can't await
-        await writer.drain() # must await, empty the writer buffer? If the buffer is too big
-        data = await reader.readline() 
-        if not data:
-            break
-        try:
-            query = data.decode().strip()
-        except UnicodeDecodeError:
-            query = '\x00'
-        print(f' From {client}: {query!r}')
-        if query:
-            if ord(query[:1]) < 32:
+    out = bytearray(PROMPT)
+    pending = b''
+    closing = False
+    while not closing:
+        # One write and one drain for all the replies to what was read,
+        # a client may send (pipeline) several queries without waiting
+        await flush(writer, out)
+        data = await reader.read(READ_SIZE)
+        if data:
+            *lines, pending = (pending + data).split(b'\n')
+            if len(pending) > MAX_LINE:
                 break
-            results = await search(query, index, writer)
-            print(f'   To {client}: {results} results.')
+        else:  # the client is done, answer its last line if it didn't end it
+            lines, closing = [pending] if pending else [], True
+        for line in lines:
+            try:
+                query = line.decode().strip()
+            except UnicodeDecodeError:
+                query = '\x00'
+            log.info(' From %s: %r', client, query)
+            if query:
+                if ord(query[:1]) < 32:
+                    closing = True
+                    break
+                results = await search(query, index, cache, writer, out)
+                log.info('   To %s: %d results.', client, results)
+            out += PROMPT
+    if out:
+        await flush(writer, out)
     writer.close()
     await writer.wait_closed()
-    print(f'Close {client}')
+    log.info('Close %s', client)
+
+
+def parse_query(query: str) -> tuple[str, dict[str, int]]:
+    """Split the ``name=number`` options off the words of a query"""
+    words, options = [], {}
+    for part in query.split():
+        name, equals, value = part.partition('=')
+        name = name.lower()
+        # limit and top count results, so 0 is left as a word like a bad option
+        if (equals and name in OPTIONS and value.isdigit()
+                and (int(value) > 0 or name == 'cursor')):
+            options[name] = int(value)
+        else:
+            words.append(part)
+    return ' '.join(words), options
 
 
 async def search(query: str,
                  index: InvertedIndex,
-                 writer: asyncio.StreamWriter) -> int:
-    chars = index.search(query)
-    lines = (line.encode() + CRLF for line in format_results(chars))
-    writer.writelines(lines)
-    await writer.drain()
-    status_line = f'{"─" * 66} {len(chars)} found'
-    writer.write(status_line.encode() + CRLF)
-    await writer.drain()
-    return len(chars)
+                 cache: QueryCache,
+                 writer: asyncio.StreamWriter,
+                 out: bytearray) -> int:
+    """Add the reply to ``out``, only writing it early if it gets big"""
+    words, options = parse_query(query)
+    limit, cursor, top = (options.get(name) for name in OPTIONS)
+    key = normalize(words), limit, cursor, top
+    # the reply is cached already encoded, with its number of results
+    if (cached := cache.get(key)) is not None:
+        count, reply = cached
+        out += reply
+        return count
+
+    if top:
+        codes = found = [ord(char) for char, _ in index.ranked(words, top)]
+        next_cursor = None
+    else:
+        codes = index.find(words)
+        found, next_cursor = page(codes, limit, cursor)
+    # Encode in batches, so a huge result never sits whole in memory
+    cacheable = len(found) <= MAX_CACHED_RESULTS
+    batches = []
+    for start in range(0, len(found), BATCH_LINES):
+        chars = map(chr, found[start:start + BATCH_LINES])
+        batch = b''.join(line.encode() + CRLF for line in format_results(chars))
+        out += batch
+        if len(out) >= HIGH_WATER:
+            await flush(writer, out)
+        if cacheable:
+            batches.append(batch)
+    if next_cursor is None:
+        status_line = f'{"─" * 66} {len(found)} found'
+    else:
+        status_line = (f'{"─" * 66} {len(found)} of {len(codes)} found, '
+                       f'next page: cursor={next_cursor}')
+    out += status_line.encode() + CRLF
+    if cacheable:
+        batches.append(status_line.encode() + CRLF)
+        cache.put(key, (len(found), b''.join(batches)))
+    return len(found)
 
 
-async def supervisor(index: InvertedIndex, host: str, port: int) -> None:
+async def supervisor(index: InvertedIndex, cache: QueryCache,
+                     host: str, port: int) -> None:
     server = await asyncio.start_server(
-        functools.partial(finder, index), host, port
+        functools.partial(finder, index, cache), host, port
     )
 
     socket_list = cast(tuple[TransportSocket, ...], server.sockets)
@@ -58,12 +155,17 @@ async def supervisor(index: InvertedIndex, host: str, port: int) -> None:
 
 def main(host: str = '127.0.0.1', port_arg: str = '2323'):
     port = int(port_arg)
-    print('Building index.')
-    index = InvertedIndex()
+    print('Loading index.')
+    index = load_index(workers=os.cpu_count() or 1)
+    cache = QueryCache()
+    listener = start_logging()
     try:
-        asyncio.run(supervisor(index, host, port))
+        asyncio.run(supervisor(index, cache, host, port))
     except KeyboardInterrupt:
         print('\nServer shut down')
+        print(cache.summary())
+    finally:
+        listener.stop()
 
 if __name__ == '__main__':
     main(*sys.argv[1:])
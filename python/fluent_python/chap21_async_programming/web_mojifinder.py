@@ -1,13 +1,19 @@
+import json
 from pathlib import Path
 from unicodedata import name
 
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Query
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from charindex import InvertedIndex
+from charindex import Mode, load_index, page
+from querycache import QueryCache, normalize
 
 STATIC_PATH = Path(__file__).parent.absolute() / 'static'
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10_000
+MAX_CACHED_RESULTS = 1000  # longer pages would crowd the cache
+STREAM_BATCH = 256  # results encoded per chunk of a streamed response
 
 app = FastAPI(
     title='Mojifinder Web',
@@ -18,16 +24,70 @@ class CharName(BaseModel):
     char: str
     name: str
 
+class RankedChar(CharName):
+    score: float
+
 def init(app):
-    app.state.index = InvertedIndex()
+    app.state.index = load_index()
+    app.state.cache = QueryCache()
     app.state.form = (STATIC_PATH / 'form.html').read_text()
 
 init(app)
 
+def char_name(code: int) -> dict[str, str]:
+    char = chr(code)
+    return {'char': char, 'name': name(char)}
+
 @app.get('/search', response_model=list[CharName])
-async def search(q: str):
-    chars = sorted(app.state.index.search(q))
-    return ({'char': c, 'name': name(c)} for c in chars)
+async def search(q: str, mode: Mode = 'exact',
+                 limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                 cursor: int | None = None):
+    """One page of results, the next page starts after X-Next-Cursor"""
+    key = normalize(q, mode), limit, cursor
+    # the JSON body is cached encoded, so repeated queries skip the index
+    # and the validation of a CharName per result
+    if (cached := app.state.cache.get(key)) is None:
+        codes = app.state.index.find(q, mode)
+        found, next_cursor = page(codes, limit, cursor)
+        body = json.dumps([char_name(code) for code in found], ensure_ascii=False)
+        headers = {'X-Total-Count': str(len(codes))}
+        if next_cursor is not None:
+            headers['X-Next-Cursor'] = str(next_cursor)
+        cached = body.encode(), headers
+        if len(found) <= MAX_CACHED_RESULTS:
+            app.state.cache.put(key, cached)
+    body, headers = cached
+    return Response(body, media_type='application/json', headers=headers)
+
+@app.get('/search/ranked', response_model=list[RankedChar])
+async def search_ranked(q: str, mode: Mode = 'exact',
+                        k: int = Query(10, ge=1, le=MAX_LIMIT)):
+    """The ``k`` characters with the best scores for any word of ``q``"""
+    key = 'ranked', normalize(q, mode), k
+    if (body := app.state.cache.get(key)) is None:
+        results = [{**char_name(ord(char)), 'score': score}
+                   for char, score in app.state.index.ranked(q, k, mode)]
+        body = json.dumps(results, ensure_ascii=False).encode()
+        app.state.cache.put(key, body)
+    return Response(body, media_type='application/json')
+
+@app.get('/search/stream')
+async def search_stream(q: str, mode: Mode = 'exact', cursor: int | None = None):
+    """Every result after ``cursor`` as NDJSON, one CharName per line"""
+    found, _ = page(app.state.index.find(q, mode), None, cursor)
+
+    def lines():
+        for start in range(0, len(found), STREAM_BATCH):
+            batch = found[start:start + STREAM_BATCH]
+            yield ''.join(json.dumps(char_name(code), ensure_ascii=False) + '\n'
+                          for code in batch).encode()
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+@app.get('/stats', include_in_schema=False)
+def stats():
+    cache = app.state.cache
+    return {'entries': len(cache), 'hits': cache.hits, 'misses': cache.misses}
 
 @app.get('/', response_class=HTMLResponse, include_in_schema=False)
 def form():
@@ -0,0 +1,141 @@
+"""
+Whole-array version of ``update`` in main.py.
+
+Instead of looping over the particles and calling the scalar kernels once per
+pair, the step builds the list of interacting pairs (all of them, or only the
+ones from neighboring cells when a ``SpatialHash`` is given) and evaluates the
+kernels, densities and forces on those arrays at once.
+
+The serial loop updates particle after particle, so part of the particles see
+densities and positions from the current step and the rest from the previous
+one. Here every density is computed before any force and every force before
+any particle moves, which is the usual SPH ordering and doesn't depend on the
+particle order.
+"""
+import numpy as np
+
+from constants import (
+    BOX_HEIGHT,
+    BOX_WIDTH,
+    COLLISION_DAMPING,
+    MASS,
+    PRESSURE_MULTIPLIER,
+    RADIUS,
+    SMOOTHING_RADIUS,
+    TARGET_DENSITY,
+)
+from kernels import DEFAULT_KERNEL, Kernel
+from neighbors import SpatialHash
+
+# Same lower bounds used by calculate_pressure_force
+MIN_DISTANCE = 1.0e-3 # [m]
+MIN_DENSITY = 1.0e-3 # [kg/m2]
+
+
+def calculate_pressure_factor(densities: np.ndarray) -> np.ndarray:
+    return PRESSURE_MULTIPLIER * (densities - TARGET_DENSITY) # [kg/m2.s2]
+
+
+def particle_pairs(positions: np.ndarray, neighbor_grid: SpatialHash | None = None, radius: float = SMOOTHING_RADIUS) -> tuple[np.ndarray, np.ndarray]:
+    """(i, j) pairs closer than ``radius``, self pairs included"""
+    if neighbor_grid is None:
+        num_particles = len(positions)
+        first = np.repeat(np.arange(num_particles), num_particles)
+        second = np.tile(np.arange(num_particles), num_particles)
+    else:
+        neighbor_grid.build(positions)
+        first, second = neighbor_grid.pairs(positions)
+    offsets = positions[first] - positions[second]
+    close = np.einsum("ij,ij->i", offsets, offsets) < radius * radius
+    return first[close], second[close]
+
+
+def calculate_densities(positions: np.ndarray, first: np.ndarray, second: np.ndarray, kernel: Kernel = DEFAULT_KERNEL) -> np.ndarray:
+    dst = np.linalg.norm(positions[first] - positions[second], axis=1) # [m]
+    influence = kernel.value(dst) # [1/m2]
+    return np.bincount(first, weights=MASS * influence, minlength=len(positions)) # [kg/m2]
+
+
+def calculate_pressure_forces(positions: np.ndarray, densities: np.ndarray, first: np.ndarray, second: np.ndarray, kernel: Kernel = DEFAULT_KERNEL) -> np.ndarray:
+    others = first != second
+    first, second = first[others], second[others]
+
+    offsets = positions[first] - positions[second]
+    dst = np.linalg.norm(offsets, axis=1) # [m]
+    directions = np.zeros_like(offsets)
+    apart = dst > MIN_DISTANCE
+    directions[apart] = offsets[apart] / dst[apart, np.newaxis]
+    # Particles on top of each other push in a random direction, as in the serial path
+    num_together = np.count_nonzero(~apart)
+    if num_together:
+        random_vectors = np.random.randn(num_together, 2)
+        directions[~apart, :2] = random_vectors / np.linalg.norm(random_vectors, axis=1, keepdims=True)
+
+    density = np.maximum(densities[second], MIN_DENSITY) # [kg/m2]
+    slope = kernel.derivative(dst) # [1/m3]
+    pressure_factor = calculate_pressure_factor(density) # [kg/m2.s2]
+    magnitude = pressure_factor * slope * MASS / density
+
+    pressure_forces = np.zeros_like(positions)
+    for axis in range(positions.shape[1]):
+        pressure_forces[:, axis] = np.bincount(first, weights=directions[:, axis] * magnitude, minlength=len(positions))
+    return pressure_forces # [kg.m/s2]
+
+
+def sample_densities(sample_points: np.ndarray, positions: np.ndarray, neighbor_grid: SpatialHash | None = None, chunk_size: int = 4096, kernel: Kernel = DEFAULT_KERNEL) -> np.ndarray:
+    """Density at arbitrary points (e.g. a visualization grid), all at once.
+
+    The points are processed ``chunk_size`` at a time so the temporary arrays
+    stay bounded for fine grids.
+    """
+    # When the 3x3 block of cells is the whole box every point sees every
+    # particle, and a dense distance matrix is much cheaper than pair lists
+    dense = neighbor_grid is None or (neighbor_grid.num_cols <= 3 and neighbor_grid.num_rows <= 3)
+    if not dense:
+        neighbor_grid.build(positions)
+    squared_norms = np.einsum("ij,ij->i", positions, positions)
+
+    densities = np.zeros(len(sample_points))
+    for begin in range(0, len(sample_points), chunk_size):
+        chunk = sample_points[begin:begin + chunk_size]
+        if dense:
+            # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, a matrix product instead of N x M differences
+            squared_dst = np.einsum("ij,ij->i", chunk, chunk)[:, np.newaxis] + squared_norms - 2.0 * chunk @ positions.T
+            influence = kernel.value(np.sqrt(np.maximum(squared_dst, 0.0))) # [1/m2]
+            densities[begin:begin + len(chunk)] = MASS * influence.sum(axis=1)
+        else:
+            first, second = neighbor_grid.pairs(chunk)
+            dst = np.linalg.norm(chunk[first] - positions[second], axis=1) # [m]
+            influence = kernel.value(dst) # [1/m2]
+            densities[begin:begin + len(chunk)] = np.bincount(first, weights=MASS * influence, minlength=len(chunk))
+    return densities # [kg/m2]
+
+
+def resolve_collisions(positions: np.ndarray, velocities: np.ndarray) -> None:
+    half_bounds_size = 0.5 * np.array([BOX_WIDTH, BOX_HEIGHT]) - RADIUS
+    for axis, half_size in enumerate(half_bounds_size):
+        outside = np.abs(positions[:, axis]) > half_size
+        positions[outside, axis] = half_size * np.sign(positions[outside, axis])
+        velocities[outside, axis] *= -1.0 * COLLISION_DAMPING
+
+
+def max_acceleration(accelerations: np.ndarray) -> float:
+    if len(accelerations) == 0:
+        return 0.0
+    return float(np.sqrt(np.einsum("ij,ij->i", accelerations, accelerations).max()))
+
+
+def step(positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray, delta_t: float, neighbor_grid: SpatialHash | None = None, kernel: Kernel = DEFAULT_KERNEL) -> float:
+    """Advance all the particles by ``delta_t``, updating the arrays in place.
+
+    Returns the largest pressure acceleration, used to pick the next time step.
+    """
+    first, second = particle_pairs(positions, neighbor_grid, kernel.radius)
+    densities[:] = calculate_densities(positions, first, second, kernel)
+    pressure_forces = calculate_pressure_forces(positions, densities, first, second, kernel)
+
+    pressure_accelerations = pressure_forces / densities[:, np.newaxis] # [m3/s2]
+    velocities += pressure_accelerations * delta_t
+    positions += velocities * delta_t
+    resolve_collisions(positions, velocities)
+    return max_acceleration(pressure_accelerations) # [m/s2]
@@ -0,0 +1,185 @@
+"""
+Benchmark of the SPH solver, without any window.
+
+For each particle count and backend it times full steps, for the numpy
+backend also each phase of the step, and the field sampling on square grids
+of several sizes. Peak memory is the tracemalloc peak during the measured
+calls, which includes the NumPy arrays but not Numba's internal allocations.
+
+The smoothing radius is scaled with the particle count so every particle has
+about ``--neighbors`` neighbors, otherwise 100k particles with the default
+radius (as wide as the box) would be a single all-pairs problem.
+
+    python benchmark.py --particles 100 1000 10000 100000 --json bench.json
+    python benchmark.py --particles 100000 --dtype float32
+"""
+import argparse
+import json
+import math
+import time
+import tracemalloc
+from collections.abc import Callable
+
+import numpy as np
+
+import batched
+import numba_backend
+from constants import BOX_HEIGHT, BOX_WIDTH
+from kernels import make_kernel
+from main import update
+from neighbors import SpatialHash
+from particles import DTYPES, ParticleStore
+
+# The serial loop is O(N) Python calls per particle, past this it takes minutes
+MAX_SERIAL_PARTICLES = 1000
+
+
+def measure(function: Callable[[], object], repeats: int) -> tuple[float, float]:
+    """Mean seconds per call and peak traced memory in MB"""
+    function() # warm up (and JIT compile)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    elapsed = (time.perf_counter() - start) / repeats
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1.0e6
+
+
+def random_state(num_particles: int, dim: int = 2, dtype: str = "float64", seed: int = 42) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    store = ParticleStore(num_particles, dim, DTYPES[dtype])
+    store.positions[:, 0] = rng.uniform(-0.5 * BOX_WIDTH, 0.5 * BOX_WIDTH, num_particles)
+    store.positions[:, 1] = rng.uniform(-0.5 * BOX_HEIGHT, 0.5 * BOX_HEIGHT, num_particles)
+    return store.positions, store.velocities, store.densities
+
+
+def radius_for(num_particles: int, neighbors: int) -> float:
+    # pi h^2 * (N / area) = neighbors
+    radius = math.sqrt(neighbors * BOX_WIDTH * BOX_HEIGHT / (math.pi * num_particles))
+    return min(radius, max(BOX_WIDTH, BOX_HEIGHT))
+
+
+def available_backends() -> dict[str, Callable[..., float]]:
+    backends = {"serial": update, "numpy": batched.step}
+    if numba_backend.NUMBA_AVAILABLE:
+        backends["numba"] = numba_backend.step
+    return backends
+
+
+def bench_steps(num_particles: int, radius: float, repeats: int, delta_t: float, dim: int = 2, dtype: str = "float64") -> list[dict]:
+    kernel = make_kernel("poly6", radius)
+    results = []
+    for name, step_function in available_backends().items():
+        if name == "serial" and num_particles > MAX_SERIAL_PARTICLES:
+            continue
+        positions, velocities, densities = random_state(num_particles, dim, dtype)
+        neighbor_grid = SpatialHash(radius, BOX_WIDTH, BOX_HEIGHT)
+        seconds, peak = measure(
+            lambda: step_function(positions, velocities, densities, delta_t, neighbor_grid, kernel=kernel),
+            1 if name == "serial" else repeats,
+        )
+        results.append({
+            "backend": name,
+            "particles": num_particles,
+            "radius": radius,
+            "steps_per_second": 1.0 / seconds,
+            "ms_per_step": 1000.0 * seconds,
+            "peak_mb": peak,
+        })
+    return results
+
+
+def bench_phases(num_particles: int, radius: float, repeats: int, delta_t: float, dim: int = 2, dtype: str = "float64") -> dict:
+    """Time of each phase of ``batched.step``, in ms"""
+    kernel = make_kernel("poly6", radius)
+    positions, velocities, densities = random_state(num_particles, dim, dtype)
+    neighbor_grid = SpatialHash(radius, BOX_WIDTH, BOX_HEIGHT)
+
+    build, _ = measure(lambda: neighbor_grid.build(positions), repeats)
+    pair_search, _ = measure(lambda: batched.particle_pairs(positions, neighbor_grid, radius), repeats)
+    first, second = batched.particle_pairs(positions, neighbor_grid, radius)
+    density, _ = measure(lambda: batched.calculate_densities(positions, first, second, kernel), repeats)
+    densities[:] = batched.calculate_densities(positions, first, second, kernel)
+    force, _ = measure(lambda: batched.calculate_pressure_forces(positions, densities, first, second, kernel), repeats)
+    forces = batched.calculate_pressure_forces(positions, densities, first, second, kernel)
+
+    def integrate():
+        new_velocities = velocities + forces / densities[:, np.newaxis] * delta_t
+        new_positions = positions + new_velocities * delta_t
+        batched.resolve_collisions(new_positions, new_velocities)
+
+    integration, _ = measure(integrate, repeats)
+    return {
+        "particles": num_particles,
+        "pairs": len(first),
+        "grid_build_ms": 1000.0 * build,
+        # particle_pairs rebuilds the grid, so this includes the build time
+        "pair_search_ms": 1000.0 * pair_search,
+        "density_ms": 1000.0 * density,
+        "pressure_force_ms": 1000.0 * force,
+        "integration_ms": 1000.0 * integration,
+    }
+
+
+def bench_fields(num_particles: int, radius: float, resolution: int, repeats: int, dim: int = 2, dtype: str = "float64") -> dict:
+    kernel = make_kernel("poly6", radius)
+    positions, _, _ = random_state(num_particles, dim, dtype)
+    neighbor_grid = SpatialHash(radius, BOX_WIDTH, BOX_HEIGHT)
+    xx = np.linspace(-0.5 * BOX_WIDTH, 0.5 * BOX_WIDTH, resolution)
+    yy = np.linspace(-0.5 * BOX_HEIGHT, 0.5 * BOX_HEIGHT, resolution)
+    grid_x, grid_y, grid_z = np.meshgrid(xx, yy, 0.0)
+    sample_points = np.column_stack([grid_x.ravel(), grid_y.ravel(), grid_z.ravel()])[:, :dim].astype(dtype)
+    seconds, peak = measure(lambda: batched.sample_densities(sample_points, positions, neighbor_grid, kernel=kernel), repeats)
+    return {
+        "particles": num_particles,
+        "resolution": resolution,
+        "ms_per_sample": 1000.0 * seconds,
+        "peak_mb": peak,
+    }
+
+
+def print_table(title: str, rows: list[dict]) -> None:
+    if not rows:
+        return
+    print(f"\n{title}")
+    columns = list(rows[0])
+    print("  ".join(f"{column:>18}" for column in columns))
+    for row in rows:
+        cells = (f"{value:>18.3f}" if isinstance(value, float) else f"{value!s:>18}" for value in row.values())
+        print("  ".join(cells))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the SPH solver")
+    parser.add_argument("--particles", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[15, 64, 256])
+    parser.add_argument("--neighbors", type=int, default=30, help="average neighbors per particle")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--delta-t", type=float, default=1.0 / 24.0)
+    parser.add_argument("--dim", type=int, choices=(2, 3), default=2)
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="float64")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    steps, phases, fields = [], [], []
+    for num_particles in args.particles:
+        radius = radius_for(num_particles, args.neighbors)
+        steps.extend(bench_steps(num_particles, radius, args.repeats, args.delta_t, args.dim, args.dtype))
+        phases.append(bench_phases(num_particles, radius, args.repeats, args.delta_t, args.dim, args.dtype))
+        for resolution in args.resolutions:
+            fields.append(bench_fields(num_particles, radius, resolution, args.repeats, args.dim, args.dtype))
+
+    print_table("Steps", steps)
+    print_table("Phases of the numpy step (ms)", phases)
+    print_table("Field sampling", fields)
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump({"dim": args.dim, "dtype": args.dtype, "steps": steps, "phases": phases, "fields": fields}, fp, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
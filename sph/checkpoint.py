@@ -0,0 +1,99 @@
+"""
+Checkpoints of a running simulation, to restart it after a crash.
+
+The particle arrays are written to ``np.memmap`` files, so saving is a copy
+into pages the OS flushes on its own instead of serializing everything. There
+are two slots used in turns and ``state.json`` (replaced atomically) names the
+last complete one, so a crash while saving leaves the previous checkpoint
+usable. The arrays keep their dtype (float64 or float32, see particles.py).
+
+``state.json`` also keeps the step, the simulated time and the state of the
+``random`` and ``np.random`` generators (placement of the particles and the
+random push of overlapping particles). Numba's generator can't be saved, a
+run resumed with that backend only differs in those random pushes.
+"""
+import json
+import os
+import random
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+STATE_FILE = "state.json"
+ARRAYS = ("positions", "velocities", "densities")
+
+
+class Checkpoint(NamedTuple):
+    step: int
+    time: float
+    positions: np.ndarray
+    velocities: np.ndarray
+    densities: np.ndarray
+
+
+def random_state() -> dict:
+    version, internal_state, gauss_next = random.getstate()
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        "random": [version, list(internal_state), gauss_next],
+        "numpy": [name, keys.tolist(), pos, has_gauss, cached_gaussian],
+    }
+
+
+def set_random_state(state: dict) -> None:
+    version, internal_state, gauss_next = state["random"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+    name, keys, pos, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+
+class Checkpointer:
+    def __init__(self, directory: str | Path) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def array_path(self, slot: int, name: str) -> Path:
+        return self.directory / f"{name}.{slot}.dat"
+
+    def read_state(self) -> dict | None:
+        try:
+            return json.loads((self.directory / STATE_FILE).read_text())
+        except FileNotFoundError:
+            return None
+
+    def save(self, step: int, time: float, positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray) -> None:
+        state = self.read_state()
+        # Never overwrite the slot of the last good checkpoint
+        slot = 1 - state["slot"] if state else 0
+        shapes = {}
+        for name, array in zip(ARRAYS, (positions, velocities, densities)):
+            mapped = np.memmap(self.array_path(slot, name), dtype=array.dtype, mode="w+", shape=array.shape)
+            mapped[:] = array
+            mapped.flush()
+            shapes[name] = list(array.shape)
+            del mapped
+
+        new_state = {
+            "slot": slot,
+            "step": step,
+            "time": time,
+            "dtype": positions.dtype.str,
+            "shapes": shapes,
+            "rng": random_state(),
+        }
+        temporary = self.directory / (STATE_FILE + ".tmp")
+        temporary.write_text(json.dumps(new_state))
+        os.replace(temporary, self.directory / STATE_FILE)
+
+    def load(self) -> Checkpoint | None:
+        """Last checkpoint, with the random generators restored, or None"""
+        state = self.read_state()
+        if state is None:
+            return None
+        arrays = [
+            np.array(np.memmap(self.array_path(state["slot"], name), dtype=state.get("dtype", "<f8"), mode="r", shape=tuple(state["shapes"][name])))
+            for name in ARRAYS
+        ]
+        set_random_state(state["rng"])
+        return Checkpoint(state["step"], state["time"], *arrays)
@@ -0,0 +1,12 @@
+# Physical and geometric constants shared by the SPH modules
+GRAVITY = 9.81 # [m/s2]
+BOX_HEIGHT = 10.0 # [m]
+BOX_WIDTH = 10.0 # [m]
+RADIUS = 0.1 # [m]
+COLLISION_DAMPING = 0.6 # [-]
+NUM_PARTICLES = 25 # [-]
+BETWEEN_PARTICLE_SPACING = 0.0 # [m]
+SMOOTHING_RADIUS = 10.0 # [m]
+MASS = 1.0 # [kg]
+TARGET_DENSITY = 0.1 # [kg/m2]
+PRESSURE_MULTIPLIER = 10.0 # [m4/s2]
@@ -0,0 +1,70 @@
+"""
+Sub-stepping integrator with the time step picked by a CFL condition.
+
+A frame (1/fps of simulated time) is covered by as many steps as needed so
+that no particle travels more than a fraction ``cfl_number`` of the smoothing
+radius per step, and the pressure acceleration can't build up more than that
+either. Calm phases take one big step per frame, violent ones get split.
+
+The acceleration of a step is only known after it, so the next step is sized
+with the largest acceleration of the previous one.
+"""
+import math
+import time
+from collections.abc import Callable
+
+import numpy as np
+
+from constants import SMOOTHING_RADIUS
+from neighbors import SpatialHash
+
+CFL_NUMBER = 0.4 # [-]
+MIN_TIME_STEP = 1.0e-5 # [s]
+
+StepFunction = Callable[[np.ndarray, np.ndarray, np.ndarray, float, SpatialHash | None], float]
+
+
+class AdaptiveIntegrator:
+    def __init__(self, step_function: StepFunction, cfl_number: float = CFL_NUMBER, min_time_step: float = MIN_TIME_STEP) -> None:
+        self.step_function = step_function
+        self.cfl_number = cfl_number
+        self.min_time_step = min_time_step
+        self.max_acceleration = 0.0 # [m/s2]
+        self.num_steps = 0
+        self.simulated_time = 0.0 # [s]
+        self.wall_time = 0.0 # [s]
+
+    def time_step(self, velocities: np.ndarray, max_time_step: float) -> float:
+        max_speed = math.sqrt(np.einsum("ij,ij->i", velocities, velocities).max()) if len(velocities) else 0.0
+        time_step = max_time_step
+        if max_speed > 0.0:
+            time_step = min(time_step, self.cfl_number * SMOOTHING_RADIUS / max_speed)
+        if self.max_acceleration > 0.0:
+            time_step = min(time_step, self.cfl_number * math.sqrt(SMOOTHING_RADIUS / self.max_acceleration))
+        return max(time_step, self.min_time_step)
+
+    def advance(self, positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray, frame_time: float, neighbor_grid: SpatialHash | None = None) -> int:
+        """Advance the particles by ``frame_time``, returns the number of steps taken"""
+        start = time.perf_counter()
+        remaining = frame_time
+        num_steps = 0
+        # Leftovers smaller than this are rounding errors, not a step worth taking
+        while remaining > 1.0e-9 * frame_time:
+            delta_t = min(self.time_step(velocities, frame_time), remaining)
+            self.max_acceleration = self.step_function(positions, velocities, densities, delta_t, neighbor_grid)
+            remaining -= delta_t
+            num_steps += 1
+        self.num_steps += num_steps
+        self.simulated_time += frame_time
+        self.wall_time += time.perf_counter() - start
+        return num_steps
+
+    @property
+    def steps_per_second(self) -> float:
+        return self.num_steps / self.wall_time if self.wall_time > 0.0 else 0.0
+
+    def report(self) -> str:
+        return (
+            f"{self.num_steps} steps, {self.steps_per_second:.1f} steps/s, "
+            f"{self.simulated_time / self.wall_time if self.wall_time > 0.0 else 0.0:.3f} simulated s per wall s"
+        )
@@ -0,0 +1,129 @@
+"""
+Smoothing kernels with their normalization constants computed once.
+
+Every kernel has the same interface: ``value(dst)`` and ``derivative(dst)``
+accept a float or an array of distances and are zero beyond ``radius``. The
+constants are for 2D, so each kernel integrates to 1 over the plane.
+
+``TabulatedKernel`` wraps any of them and serves both functions from a table
+sampled once and linearly interpolated, trading a little accuracy for a
+cheaper evaluation of the more expensive kernels.
+"""
+import math
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from constants import SMOOTHING_RADIUS
+
+
+class Kernel(ABC):
+    name = ""
+
+    def __init__(self, radius: float) -> None:
+        self.radius = radius
+
+    @abstractmethod
+    def value(self, dst):
+        ...
+
+    @abstractmethod
+    def derivative(self, dst):
+        ...
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.radius!r})"
+
+
+class Poly6Kernel(Kernel):
+    """(h^2 - r^2)^3, the kernel the solver started with"""
+    name = "poly6"
+
+    def __init__(self, radius: float) -> None:
+        super().__init__(radius)
+        self.value_factor = 4.0 / (math.pi * math.pow(radius, 8)) # [1/m8]
+        self.derivative_factor = - 24.0 / (math.pi * math.pow(radius, 8)) # [1/m8]
+
+    def value(self, dst):
+        value = np.maximum(0.0, self.radius * self.radius - dst * dst) # [m2]
+        return self.value_factor * value * value * value # [1/m2]
+
+    def derivative(self, dst):
+        value = np.maximum(0.0, self.radius * self.radius - dst * dst) # [m2]
+        return self.derivative_factor * dst * value * value # [1/m3]
+
+
+class SpikyKernel(Kernel):
+    """(h - r)^3, its gradient doesn't vanish when particles get close"""
+    name = "spiky"
+
+    def __init__(self, radius: float) -> None:
+        super().__init__(radius)
+        self.value_factor = 10.0 / (math.pi * math.pow(radius, 5)) # [1/m5]
+        self.derivative_factor = - 30.0 / (math.pi * math.pow(radius, 5)) # [1/m5]
+
+    def value(self, dst):
+        value = np.maximum(0.0, self.radius - dst) # [m]
+        return self.value_factor * value * value * value # [1/m2]
+
+    def derivative(self, dst):
+        value = np.maximum(0.0, self.radius - dst) # [m]
+        return self.derivative_factor * value * value # [1/m3]
+
+
+class CubicSplineKernel(Kernel):
+    """Monaghan's cubic B-spline, with its support (2h in the literature) equal to ``radius``"""
+    name = "cubic"
+
+    def __init__(self, radius: float) -> None:
+        super().__init__(radius)
+        half_radius = 0.5 * radius
+        self.value_factor = 10.0 / (7.0 * math.pi * half_radius * half_radius) # [1/m2]
+        self.derivative_factor = self.value_factor / half_radius # [1/m3]
+
+    def value(self, dst):
+        q = 2.0 * np.asarray(dst) / self.radius
+        inner = 1.0 - 1.5 * q * q + 0.75 * q * q * q
+        outer = 0.25 * np.maximum(0.0, 2.0 - q) ** 3
+        return self.value_factor * np.where(q < 1.0, inner, outer) # [1/m2]
+
+    def derivative(self, dst):
+        q = 2.0 * np.asarray(dst) / self.radius
+        inner = -3.0 * q + 2.25 * q * q
+        outer = -0.75 * np.maximum(0.0, 2.0 - q) ** 2
+        return self.derivative_factor * np.where(q < 1.0, inner, outer) # [1/m3]
+
+
+class TabulatedKernel(Kernel):
+    """Any kernel sampled on ``size`` points in [0, radius] and interpolated"""
+
+    def __init__(self, base: Kernel, size: int = 1024) -> None:
+        super().__init__(base.radius)
+        self.base = base
+        self.name = base.name
+        self.samples = np.linspace(0.0, base.radius, size)
+        self.values = base.value(self.samples)
+        self.derivatives = base.derivative(self.samples)
+
+    def value(self, dst):
+        return np.interp(dst, self.samples, self.values, right=0.0)
+
+    def derivative(self, dst):
+        return np.interp(dst, self.samples, self.derivatives, right=0.0)
+
+    def __repr__(self) -> str:
+        return f"TabulatedKernel({self.base!r}, {len(self.samples)})"
+
+
+KERNELS = {kernel.name: kernel for kernel in (Poly6Kernel, SpikyKernel, CubicSplineKernel)}
+
+
+def make_kernel(name: str = "poly6", radius: float = SMOOTHING_RADIUS, table_size: int = 0) -> Kernel:
+    """Kernel by name, tabulated when ``table_size`` is given"""
+    kernel = KERNELS[name](radius)
+    if table_size:
+        return TabulatedKernel(kernel, table_size)
+    return kernel
+
+
+DEFAULT_KERNEL = make_kernel()
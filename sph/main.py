@@ -1,15 +1,46 @@
+from __future__ import annotations # the pv.* annotations must not need pyvista
+
+import argparse
 import math
-import inspect
 import sys
-import vtk
 import numpy as np
-import pyvista as pv
+
+try:
+    import pyvista as pv
+    import vtk
+except ImportError: # machines without a renderer can still run --headless
+    pv = vtk = None
 
 import random
 
 import time
+from collections.abc import Callable
+from functools import partial
 from dataclasses import dataclass
 
+from batched import sample_densities, step
+from checkpoint import Checkpointer
+from constants import (
+    BETWEEN_PARTICLE_SPACING,
+    BOX_HEIGHT,
+    BOX_WIDTH,
+    COLLISION_DAMPING,
+    MASS,
+    NUM_PARTICLES,
+    PRESSURE_MULTIPLIER,
+    RADIUS,
+    SMOOTHING_RADIUS,
+    TARGET_DENSITY,
+)
+from integrator import AdaptiveIntegrator
+from kernels import DEFAULT_KERNEL, KERNELS, Kernel, make_kernel
+from neighbors import SpatialHash
+import numba_backend
+from parallel import SlabStepper
+from particles import DTYPES, ParticleStore, as_points
+from profiling import PhaseTimer, StatsLog
+from recording import FrameWriter
+
 
 # Configure pyvista and vtk to suppress errors because I was getting a annoying
 # "Could not set shader program" error and traceback
@@ -17,52 +48,46 @@ from dataclasses import dataclass
 #vtk_output = vtk.vtkOutputWindow.GetInstance()
 #vtk_output.SetInstance(vtk.vtkStringOutputWindow())
 
-# Constants
-GRAVITY = 9.81 # [m/s2]
-BOX_HEIGHT = 10.0 # [m]
-BOX_WIDTH = 10.0 # [m]
-RADIUS = 0.1 # [m]
-COLLISION_DAMPING = 0.6 # [-]
-NUM_PARTICLES = 25 # [-]
-BETWEEN_PARTICLE_SPACING = 0.0 # [m]
-SMOOTHING_RADIUS = 10.0 # [m]
-MASS = 1.0 # [kg]
-TARGET_DENSITY = 0.1 # [kg/m2]
-PRESSURE_MULTIPLIER = 10.0 # [m4/s2]
-
 DEBUG = False
 DISPLAY_INITIAL_CONDITION = False
 DISPLAY_FIRST_TIME_ITERATION = False
-
-def main():
+# Step functions, all with the signature of update()
+BACKENDS = ("serial", "numpy", "numba")
+# Frames (or headless steps) between refreshes of the timing overlay/log
+STATS_EVERY = 24
+# Particles are drawn as sprites, their size is in pixels and not in meters
+PARTICLE_POINT_SIZE = 10.0
+
+def main(fps: float = 24.0, field_resolution: int = 15, backend: str = "numpy", adaptive: bool = False, kernel: Kernel = DEFAULT_KERNEL, checkpoint_dir: str | None = None, checkpoint_every: int = 0, resume: bool = False, show_stats: bool = False, dim: int = 2, dtype: str = "float64"):
+    step_function = select_step(backend, kernel)
+    integrator = AdaptiveIntegrator(step_function) if adaptive else None
+    if pv is None:
+        sys.exit("The window needs pyvista, install it or run with --headless")
     pl = pv.Plotter()
 
     start_bounding_box(pl)
     # positions: list[np.ndarray] = []
     # velocities: list[np.ndarray] = []
-    positions: np.ndarray = np.zeros(shape=(NUM_PARTICLES, 3), dtype=float)
-    velocities: np.ndarray = np.zeros(shape=(NUM_PARTICLES, 3), dtype=float)
-    densities: np.ndarray = np.zeros(NUM_PARTICLES, dtype=float)
+    # Views of the per-component arrays of the store, see particles.py
+    store = ParticleStore(NUM_PARTICLES, dim, DTYPES[dtype])
+    positions, velocities, densities = store.positions, store.velocities, store.densities
     # draw_particles(pl, positions)
+    # Cells as wide as the smoothing radius, so only the 3x3 neighbor cells matter
+    neighbor_grid = SpatialHash(SMOOTHING_RADIUS, BOX_WIDTH, BOX_HEIGHT)
 
     # fields: properties computed on a cartesian grid
-    xx = np.linspace(-0.5 * BOX_WIDTH, 0.5 * BOX_WIDTH, 15)
-    yy = np.linspace(-0.5 * BOX_HEIGHT, 0.5 * BOX_HEIGHT, 15)
-    density_field = np.zeros((len(xx) , len(yy)))
-    pressure_field = np.zeros((len(xx) , len(yy)))
+    xx = np.linspace(-0.5 * BOX_WIDTH, 0.5 * BOX_WIDTH, field_resolution)
+    yy = np.linspace(-0.5 * BOX_HEIGHT, 0.5 * BOX_HEIGHT, field_resolution)
+    density_field = np.zeros((len(yy) , len(xx)))
+    pressure_field = np.zeros((len(yy) , len(xx)))
 
     grid_x, grid_y, grid_z = np.meshgrid(xx, yy, 0.0)
+    # density_field[j, i] is sampled at (xx[i], yy[j]), the same order as the meshgrid
+    sample_points = np.column_stack([grid_x.ravel(), grid_y.ravel(), grid_z.ravel()])[:, :dim].astype(store.dtype)
 
     def update_fields(density_field, pressure_field):
-        for j, y in enumerate(yy):
-            for i, x in enumerate(xx):
-                sample_point = np.array([x, y, 0.0])
-                density_field[j, i] = calculate_density(sample_point, positions)
-                pressure_field[j, i] = (TARGET_DENSITY - density_field[j, i]) / TARGET_DENSITY
-                if DEBUG:
-                    function_name = inspect.currentframe().f_code.co_name
-                    print(f"\n{function_name}")
-                    print(f"{sample_point=}, {density_field[j, i]=}, {pressure_field=}")
+        density_field[:] = sample_densities(sample_points, positions, neighbor_grid, kernel=kernel).reshape(density_field.shape)
+        pressure_field[:] = (TARGET_DENSITY - density_field) / TARGET_DENSITY
 
     update_fields(density_field, pressure_field)
     fields = pv.StructuredGrid(grid_x, grid_y, grid_z)
@@ -79,42 +104,61 @@ def main():
     }
     pl.add_mesh(fields, scalars="pressures", cmap="PuOr", scalar_bar_args=scalar_bar_args)
 
-    circles = start_particles_random(pl, positions)
+    particles = start_particles_random(pl, positions)
+    checkpointer = Checkpointer(checkpoint_dir) if checkpoint_dir and (checkpoint_every or resume) else None
+    first_frame = restore(checkpointer, positions, velocities, densities) if resume else 0
+    update_particles(particles, positions)
 
-    # Save a copy of the original points so we can modify them relatively
-    original_points = []
-    original_positions = positions.copy()
-    for circle in circles:
-        original_points.append(circle.points.copy())
-    # print(original_points)
+    timer = PhaseTimer()
+    stats_text = pl.add_text("", position="upper_right", font_size=8) if show_stats else None
 
     configure_plotter(pl)
     if DISPLAY_INITIAL_CONDITION:
         pl.show()
         sys.exit()
 
-    fps = 24.0
     delta_t = 1.0/fps
-    frame = 0
+    frame = first_frame
     try:
         while True:
             # Check if the user closed the window to break the loop cleanly
             if pl.render_window is None:
+                if checkpointer is not None:
+                    checkpointer.save(frame, frame * delta_t, positions, velocities, densities)
                 break
             
-            update_fields(density_field, pressure_field)
-            fields.point_data["densities"] = density_field.ravel(order="F")
-            fields.point_data["pressures"] = pressure_field.ravel(order="F")
-            update(positions, velocities, densities, delta_t, circles)
+            with timer.phase("update_fields"):
+                update_fields(density_field, pressure_field)
+            with timer.phase("point_data"):
+                fields.point_data["densities"] = density_field.ravel(order="F")
+                fields.point_data["pressures"] = pressure_field.ravel(order="F")
+            with timer.phase("update"):
+                if integrator is None:
+                    step_function(positions, velocities, densities, delta_t, neighbor_grid)
+                else:
+                    # The frame time is split in as many CFL limited steps as needed
+                    integrator.advance(positions, velocities, densities, delta_t, neighbor_grid)
+                    # About once per simulated second, at least every frame for fps < 1
+                    if frame % max(1, round(fps)) == 0:
+                        print(integrator.report())
+            with timer.phase("particles"):
+                update_particles(particles, positions)
             if DISPLAY_FIRST_TIME_ITERATION:
                 pl.show()
                 sys.exit()
 
+            if stats_text is not None and frame % STATS_EVERY == 0:
+                # Corner 3 is the upper right one
+                stats_text.SetText(3, timer.summary())
+
             # Crucial: Tell PyVista to redraw the scene
-            pl.update()
+            with timer.phase("render"):
+                pl.update()
 
             time.sleep(delta_t)
             frame += 1
+            if checkpointer is not None and checkpoint_every and frame % checkpoint_every == 0:
+                checkpointer.save(frame, frame * delta_t, positions, velocities, densities)
 
     except Exception as e:
         print(f"Loop interrupted: {e}")
@@ -124,6 +168,123 @@ def main():
         # Ensure resources are closed out properly if stopped
         pl.close()
         sys.exit()
+
+
+def run_headless(num_steps: int, delta_t: float, output: str, dump_every: int, chunk_size: int, backend: str = "numpy", workers: int = 1, adaptive: bool = False, kernel: Kernel = DEFAULT_KERNEL, checkpoint_dir: str | None = None, checkpoint_every: int = 0, resume: bool = False, stats_csv: str | None = None, dim: int = 2, dtype: str = "float64") -> None:
+    """Step as fast as possible without a window, dumping every ``dump_every`` steps.
+
+    With ``adaptive`` each of the ``num_steps`` is a frame of ``delta_t``
+    covered by CFL limited sub-steps. With ``resume`` the run continues from
+    the last checkpoint up to ``num_steps``. The rolling phase timings are
+    written to ``stats_csv`` every ``STATS_EVERY`` steps.
+    """
+    # Views of the per-component arrays of the store, see particles.py
+    store = ParticleStore(NUM_PARTICLES, dim, DTYPES[dtype])
+    positions, velocities, densities = store.positions, store.velocities, store.densities
+    neighbor_grid = SpatialHash(SMOOTHING_RADIUS, BOX_WIDTH, BOX_HEIGHT)
+    place_particles_random(positions)
+    checkpointer = Checkpointer(checkpoint_dir) if checkpoint_dir and (checkpoint_every or resume) else None
+    first_step = restore(checkpointer, positions, velocities, densities) if resume else 0
+
+    # With several workers the arrays move to shared memory and the slabs are
+    # stepped by the worker processes (always with the numpy kernels)
+    stepper = None
+    if workers > 1:
+        stepper = SlabStepper(positions, velocities, densities, workers, kernel)
+        positions, velocities, densities = stepper.positions, stepper.velocities, stepper.densities
+
+        def step_function(positions, velocities, densities, delta_t, neighbor_grid):
+            return stepper.step(delta_t)
+    else:
+        step_function = select_step(backend, kernel)
+    integrator = AdaptiveIntegrator(step_function) if adaptive else None
+
+    print(f"Running steps {first_step + 1} to {num_steps} headless, writing every {dump_every} to {output}")
+    timer = PhaseTimer()
+    stats_log = StatsLog(stats_csv, ("update", "dump", "checkpoint")) if stats_csv else None
+    start = time.perf_counter()
+    try:
+        with FrameWriter(output, chunk_size, resume_step=first_step if resume else None) as writer:
+            if not resume:
+                writer.write(0, 0.0, positions, velocities, densities)
+            for step_idx in range(first_step + 1, num_steps + 1):
+                with timer.phase("update"):
+                    if integrator is None:
+                        step_function(positions, velocities, densities, delta_t, neighbor_grid)
+                    else:
+                        integrator.advance(positions, velocities, densities, delta_t, neighbor_grid)
+                if step_idx % dump_every == 0:
+                    with timer.phase("dump"):
+                        writer.write(step_idx, step_idx * delta_t, positions, velocities, densities)
+                if checkpointer is not None and checkpoint_every and step_idx % checkpoint_every == 0:
+                    with timer.phase("checkpoint"):
+                        # Frames after the checkpoint must be on disk for a resumed run to append to them
+                        writer.flush()
+                        checkpointer.save(step_idx, step_idx * delta_t, positions, velocities, densities)
+                if stats_log is not None and step_idx % STATS_EVERY == 0:
+                    stats_log.write(step_idx, timer)
+    finally:
+        if stepper is not None:
+            stepper.close()
+        if stats_log is not None:
+            stats_log.close()
+    elapsed = time.perf_counter() - start
+    steps_run = num_steps - first_step
+    print(f"{steps_run} steps in {elapsed:.2f}s ({steps_run / elapsed:.1f} steps/s)")
+    print(timer.summary())
+    if integrator is not None:
+        print(integrator.report())
+
+
+def restore(checkpointer: Checkpointer | None, positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray) -> int:
+    """Copy the last checkpoint into the arrays, returns its step (0 without one)"""
+    checkpoint = checkpointer.load() if checkpointer is not None else None
+    if checkpoint is None:
+        print("No checkpoint to resume from, starting a new run")
+        return 0
+    if checkpoint.positions.shape != positions.shape:
+        raise ValueError(f"Checkpoint has positions of shape {checkpoint.positions.shape}, this run {positions.shape}")
+    positions[:] = checkpoint.positions
+    velocities[:] = checkpoint.velocities
+    densities[:] = checkpoint.densities
+    print(f"Resuming from step {checkpoint.step} (t = {checkpoint.time:.3f} s)")
+    return checkpoint.step
+
+
+def select_step(backend: str, kernel: Kernel = DEFAULT_KERNEL) -> Callable[..., float]:
+    if backend == "numba":
+        if numba_backend.NUMBA_AVAILABLE:
+            return partial(numba_backend.step, kernel=kernel)
+        print("Numba is not installed, falling back to the numpy backend")
+        return partial(step, kernel=kernel)
+    if backend == "serial":
+        return partial(update, kernel=kernel)
+    return partial(step, kernel=kernel)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="2D SPH fluid simulation")
+    parser.add_argument("--headless", action="store_true", help="run without a window and dump frames to disk")
+    parser.add_argument("--steps", type=int, default=1000, help="number of steps of a headless run")
+    parser.add_argument("--dim", type=int, choices=(2, 3), default=2, help="components stored per particle (3 adds a z that stays 0)")
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="float64", help="precision of the particle arrays")
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy", help="implementation of the simulation step")
+    parser.add_argument("--workers", type=int, default=1, help="processes for a headless run, each one steps a slab of the box")
+    parser.add_argument("--kernel", choices=sorted(KERNELS), default="poly6", help="smoothing kernel")
+    parser.add_argument("--kernel-table", type=int, default=0, help="serve the kernel from a table of N samples (0 evaluates the formula)")
+    parser.add_argument("--adaptive", action="store_true", help="split each frame in CFL limited sub-steps")
+    parser.add_argument("--fps", type=float, default=24.0, help="frames per simulated second, delta_t = 1/fps")
+    parser.add_argument("--field-resolution", type=int, default=15, help="points per side of the density/pressure grid")
+    parser.add_argument("--checkpoint-dir", default="checkpoint", help="directory of the checkpoint files")
+    parser.add_argument("--checkpoint-every", type=int, default=0, help="save a checkpoint every N steps (0 disables)")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    parser.add_argument("--stats", action="store_true", help="show the time of each phase of the loop in the window")
+    parser.add_argument("--stats-csv", help="headless runs write the time of each phase to this CSV")
+    parser.add_argument("--output", default="frames", help="directory where the headless frames are written")
+    parser.add_argument("--dump-every", type=int, default=1, help="write one frame every N steps")
+    parser.add_argument("--chunk-size", type=int, default=100, help="frames per file on disk")
+    return parser.parse_args(argv)
+
     
 def start_bounding_box(pl: pv.Plotter) -> None:
     # Add bounding box
@@ -150,7 +311,7 @@ def configure_plotter(pl: pv.Plotter) -> None:
     print("Starting endless loop. Close the window to stop.")
 
 
-def start_particles_grid(pl: pv.Plotter, positions: np.ndarray) -> list[pv.PolyData]:
+def place_particles_grid(positions: np.ndarray) -> None:
     # Place particles in a grid formation
     particles_per_row = int(math.sqrt(NUM_PARTICLES))
     particles_per_col = int((NUM_PARTICLES - 1) / particles_per_row + 1)
@@ -162,17 +323,8 @@ def start_particles_grid(pl: pv.Plotter, positions: np.ndarray) -> list[pv.PolyD
         positions[i][0] = x
         positions[i][1] = y
 
-    circles = []
-    for i in range(NUM_PARTICLES):
-        circle = pv.Circle(radius=RADIUS, resolution=10)
-        # circle.translate(positions[i], inplace=True)
-        circle.points += positions[i]
-        pl.add_mesh(circle, color='black', show_edges=True, lighting=False)
-        circles.append(circle)
-    return circles
 
-
-def start_particles_random(pl: pv.Plotter, positions: np.ndarray) -> list[pv.PolyData]:
+def place_particles_random(positions: np.ndarray) -> None:
     random.seed(42)
 
     for i in range(NUM_PARTICLES):
@@ -181,46 +333,64 @@ def start_particles_random(pl: pv.Plotter, positions: np.ndarray) -> list[pv.Pol
         positions[i][0] = x
         positions[i][1] = y
 
-    circles = []
-    for i in range(NUM_PARTICLES):
-        circle = pv.Circle(radius=RADIUS, resolution=10)
-        # circle.translate(positions[i], inplace=True)
-        circle.points += positions[i]
-        pl.add_mesh(circle, color='black', show_edges=True, lighting=False)
-        circles.append(circle)
-    return circles
-
-def update(positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray, delta_t: float, circles: list[pv.PolyData]) -> None:
+
+def draw_particles(pl: pv.Plotter, positions: np.ndarray) -> pv.PolyData:
+    # All the particles are the points of a single mesh, so there is only one
+    # actor and one buffer to upload per frame no matter how many particles
+    particles = pv.PolyData(as_points(positions))
+    pl.add_mesh(
+        particles,
+        color='black',
+        point_size=PARTICLE_POINT_SIZE,
+        render_points_as_spheres=True,
+        lighting=False,
+    )
+    return particles
+
+
+def update_particles(particles: pv.PolyData, positions: np.ndarray) -> None:
+    # Copy into the existing VTK points array instead of creating a new one
+    particles.points[:, :positions.shape[1]] = positions
+
+
+def start_particles_grid(pl: pv.Plotter, positions: np.ndarray) -> pv.PolyData:
+    place_particles_grid(positions)
+    return draw_particles(pl, positions)
+
+
+def start_particles_random(pl: pv.Plotter, positions: np.ndarray) -> pv.PolyData:
+    place_particles_random(positions)
+    return draw_particles(pl, positions)
+
+def update(positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray, delta_t: float, neighbor_grid: SpatialHash | None = None, kernel: Kernel = DEFAULT_KERNEL) -> float:
+    """Move the particles by ``delta_t``, returns the largest pressure acceleration"""
+    # The cells are computed once per step, particles moving inside the step
+    # travel much less than a cell so the 3x3 block still covers their neighbors
+    if neighbor_grid is not None:
+        neighbor_grid.build(positions)
+
+    max_acceleration = 0.0
     # Serial
-    for idx in range(NUM_PARTICLES):
-    # for (position, velocity, density, circle) in zip(positions, velocities, densities, circles):
+    for idx in range(len(positions)):
+    # for (position, velocity, density) in zip(positions, velocities, densities):
         # velocities[idx][1] += -1.0 * GRAVITY * delta_t # [m/s]
-        densities[idx] = calculate_density(positions[idx], positions) # [kg/m2]
+        densities[idx] = calculate_density(positions[idx], positions, neighbor_grid, kernel) # [kg/m2]
 
         # pressure_force = np.array([0.0, 0.0, 0.0])
-        pressure_force = calculate_pressure_force(idx, positions, densities) # [kg.m/s2]
+        pressure_force = calculate_pressure_force(idx, positions, densities, neighbor_grid, kernel) # [kg.m/s2]
 
         # Why divide by density instead of mass?
         pressure_acceleration = pressure_force / densities[idx] # [kg.m/s2] * [m2/kg] = [m3/s2]
         # pressure_acceleration = pressure_force / MASS
+        max_acceleration = max(max_acceleration, float(np.linalg.norm(pressure_acceleration)))
         velocities[idx] += pressure_acceleration * delta_t # [m3/s] - got wrong units
 
         positions[idx] += velocities[idx] * delta_t # [m/s] * [s] = [m]
         resolve_collisions(positions[idx], velocities[idx])
-
-        circles[idx].points += velocities[idx] * delta_t
     # Parallel
-    
-
-def draw(original_points: list[pv.PolyData], circles: list[pv.PolyData], positions: np.ndarray) -> None:
-    # Update the geometry points
-    for (orig, circle, position) in zip(original_points, circles, positions):
-        print(f"{position=}")
-        print(f"{orig=}")
-        # circle.points = orig + position
-        circle.points += delta_x
-        print(f"after {circle.points=}")
 
+    return max_acceleration # [m/s2]
+    
 
 def resolve_collisions(position: np.ndarray, velocity: np.ndarray):
     bounds_size = np.array([BOX_WIDTH, BOX_HEIGHT, 0.0])
@@ -234,97 +404,78 @@ def resolve_collisions(position: np.ndarray, velocity: np.ndarray):
         position[1] = half_bounds_size[1] * np.sign(position[1])
         velocity[1] *= -1.0 * COLLISION_DAMPING
         
-def smoothing_kernel(dst: float) -> float:
-    # value = max(0.0, dst * dst - SMOOTHING_RADIUS * SMOOTHING_RADIUS) # [m2]
-    value = max(0.0, SMOOTHING_RADIUS * SMOOTHING_RADIUS - dst * dst) # [m2]
-
-    # Used to normalize the value.
-    volume_factor = math.pow(SMOOTHING_RADIUS, 8) * math.pi / 4.0 # [m8]
-    if DEBUG:
-        function_name = inspect.currentframe().f_code.co_name
-        print(f"\n{function_name}")
-        print(f"{value=}")
-        print(f"{volume_factor=}")
+def smoothing_kernel(dst: float, kernel: Kernel = DEFAULT_KERNEL) -> float:
+    # The normalization constants live in the kernel object, computed only once
+    return kernel.value(dst) # [1/m2]
 
-    # It's called volume but in 2D it has a area unit
-    return value * value * value / volume_factor  # [1/m2]
+def smoothing_kernel_derivative(dst: float, kernel: Kernel = DEFAULT_KERNEL) -> float:
+    return kernel.derivative(dst) # [1/m3]
 
-def smoothing_kernel_derivative(dst: float) -> float:
-    if dst >= SMOOTHING_RADIUS:
-        return 0.0
-    
-    value = max(0.0, SMOOTHING_RADIUS * SMOOTHING_RADIUS - dst * dst) # [m2]
-    scale = - 24.0 / (math.pi * math.pow(SMOOTHING_RADIUS, 8)) # [1/m8]
-    if DEBUG:
-        function_name = inspect.currentframe().f_code.co_name
-        print(f"\n{function_name}")
-        print(f"{value=}")
-        print(f"{scale=}")
-    return scale * dst * value * value # [1/m3]
 
 
+def neighbor_indices(sample_point: np.ndarray, positions: np.ndarray, neighbor_grid: SpatialHash | None) -> np.ndarray | range:
+    # Without a grid every particle is a candidate neighbor (the original O(N) search)
+    if neighbor_grid is None:
+        return range(len(positions))
+    return neighbor_grid.neighbors(sample_point)
 
-def calculate_density(sample_point: np.ndarray, positions: np.ndarray):
+def calculate_density(sample_point: np.ndarray, positions: np.ndarray, neighbor_grid: SpatialHash | None = None, kernel: Kernel = DEFAULT_KERNEL):
     density = 0.0
-    for position in positions:
+    for i in neighbor_indices(sample_point, positions, neighbor_grid):
+        position = positions[i]
         dst = np.linalg.norm(position - sample_point) # [m]
-        influence = smoothing_kernel(dst) # [1/m2]
+        influence = kernel.value(dst) # [1/m2]
         density += MASS * influence # [kg/m2]
 
-        if DEBUG:
-            function_name = inspect.currentframe().f_code.co_name
-            print(f"\n{function_name}")
-            print(f"{sample_point=}")
-            print(f"{position=}")
-            print(f"{dst=}")
-            print(f"{influence=}")
-            print(f"{density=}")
+    # Outside the loop, so a disabled DEBUG costs one check per call and not per pair
+    if DEBUG:
+        print("\ncalculate_density")
+        print(f"{sample_point=}")
+        print(f"{density=}")
     
     return density # [kg/m2]
 
-def calculate_property(sample_point: np.ndarray, positions: np.ndarray, particle_properties: np.ndarray) -> float:
+def calculate_property(sample_point: np.ndarray, positions: np.ndarray, particle_properties: np.ndarray, neighbor_grid: SpatialHash | None = None, kernel: Kernel = DEFAULT_KERNEL) -> float:
     """General function with SPH method to compute any property"""
     particle_property = 0.0
+    # The density at the sample point doesn't depend on the loop variable
+    density = calculate_density(sample_point, positions, neighbor_grid, kernel)
 
-    for i, position in enumerate(positions):
+    for i in neighbor_indices(sample_point, positions, neighbor_grid):
+        position = positions[i]
         dst = np.linalg.norm(sample_point - position)
-        influence = smoothing_kernel(dst)
-        density = calculate_density(sample_point, positions)
+        influence = kernel.value(dst)
         particle_property += particle_properties[i] * influence * MASS / density
 
     return particle_property
 
-def calculate_pressure_force(particle_idx: int, positions: np.ndarray, densities: np.ndarray) -> np.ndarray:
-    pressure_force = np.array([0.0, 0.0, 0.0])
+def calculate_pressure_force(particle_idx: int, positions: np.ndarray, densities: np.ndarray, neighbor_grid: SpatialHash | None = None, kernel: Kernel = DEFAULT_KERNEL) -> np.ndarray:
+    pressure_force = np.zeros_like(positions[particle_idx])
     sample_point = positions[particle_idx]
 
-    for i, position in enumerate(positions):
+    for i in neighbor_indices(sample_point, positions, neighbor_grid):
         if i == particle_idx:
             continue
+        position = positions[i]
         dst = np.linalg.norm(sample_point - position) # [m]
         if dst > 1.0e-3:
             direction = (sample_point - position) / dst
         else:
             random_vector = np.random.randn(2)
             unit_vector = random_vector / np.linalg.norm(random_vector)
-            direction = np.array([unit_vector[0], unit_vector[1], 0.0])
+            direction = np.zeros_like(sample_point)
+            direction[:2] = unit_vector
         density = densities[i] # [kg/m2]
         if density < 1.0e-3:
             density = 1.0e-3
-        slope = smoothing_kernel_derivative(dst) # [1/m3]
+        slope = kernel.derivative(dst) # [1/m3]
         pressure_factor = calculate_pressure_factor(density) # [kg/m2.s2]
         pressure_force +=  direction * pressure_factor * slope *  MASS / density # [kg/m2.s2] * [1/m3] * [kg] * [m2/kg]
-        if DEBUG:
-            function_name = inspect.currentframe().f_code.co_name
-            print(f"\n{function_name}")
-            print(f"{sample_point=}")
-            print(f"{position=}")
-            print(f"{dst=}")
-            print(f"{density=}")
-            print(f"{slope=}")
-            print(f"{pressure_factor=}")
-            print(f"{pressure_force=}")
-    
+
+    if DEBUG:
+        print("\ncalculate_pressure_force")
+        print(f"{sample_point=}")
+        print(f"{pressure_force=}")
 
 
     return pressure_force # [kg.m/s2]
@@ -337,4 +488,9 @@ def calculate_pressure_factor(density: float) -> float:
     
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    kernel = make_kernel(args.kernel, SMOOTHING_RADIUS, args.kernel_table)
+    if args.headless:
+        run_headless(args.steps, 1.0 / args.fps, args.output, args.dump_every, args.chunk_size, args.backend, args.workers, args.adaptive, kernel, args.checkpoint_dir, args.checkpoint_every, args.resume, args.stats_csv, args.dim, args.dtype)
+    else:
+        main(args.fps, args.field_resolution, args.backend, args.adaptive, kernel, args.checkpoint_dir, args.checkpoint_every, args.resume, args.stats, args.dim, args.dtype)
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class SpatialHash:
+    """Uniform grid (cell list) used to find the particles near a point.
+
+    The box is split in square-ish cells at least ``cell_size`` wide, so every
+    particle inside the smoothing radius of a point lives in the 3x3 block of
+    cells around it. ``build`` sorts the particle indices by cell key and
+    stores where each cell starts in that sorted array, so a lookup is just a
+    couple of slices instead of a loop over all the particles.
+    """
+
+    def __init__(self, cell_size: float, width: float, height: float) -> None:
+        self.num_cols = max(1, int(width // cell_size))
+        self.num_rows = max(1, int(height // cell_size))
+        self.num_cells = self.num_cols * self.num_rows
+        self.cell_width = width / self.num_cols
+        self.cell_height = height / self.num_rows
+        self.origin = np.array([-0.5 * width, -0.5 * height])
+        self.sorted_indices = np.zeros(0, dtype=np.intp)
+        self.cell_start = np.zeros(self.num_cells + 1, dtype=np.intp)
+
+    def cell_coords(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Points outside the box (e.g. grid samples on the walls) go to the border cells
+        points = np.atleast_2d(points)
+        col = np.floor((points[:, 0] - self.origin[0]) / self.cell_width).astype(np.intp)
+        row = np.floor((points[:, 1] - self.origin[1]) / self.cell_height).astype(np.intp)
+        return np.clip(col, 0, self.num_cols - 1), np.clip(row, 0, self.num_rows - 1)
+
+    def cell_keys(self, points: np.ndarray) -> np.ndarray:
+        col, row = self.cell_coords(points)
+        return row * self.num_cols + col
+
+    def build(self, positions: np.ndarray) -> None:
+        """Rebuild the cell list. Must be called every time the particles move."""
+        keys = self.cell_keys(positions)
+        self.sorted_indices = np.argsort(keys, kind="stable")
+        sorted_keys = keys[self.sorted_indices]
+        # cell_start[key]:cell_start[key + 1] is the slice of sorted_indices in that cell
+        self.cell_start = np.searchsorted(sorted_keys, np.arange(self.num_cells + 1))
+
+    def neighbors(self, point: np.ndarray) -> np.ndarray:
+        """Indices of the particles in the 3x3 block of cells around ``point``"""
+        col, row = self.cell_coords(point)
+        col, row = int(col[0]), int(row[0])
+        first_col = max(0, col - 1)
+        last_col = min(self.num_cols - 1, col + 1)
+
+        chunks = []
+        for r in range(max(0, row - 1), min(self.num_rows, row + 2)):
+            # The cells of a row are contiguous in the sorted array, so each row is one slice
+            begin = self.cell_start[r * self.num_cols + first_col]
+            end = self.cell_start[r * self.num_cols + last_col + 1]
+            chunks.append(self.sorted_indices[begin:end])
+        return np.concatenate(chunks)
+
+    def pairs(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """All (i, j) pairs of point i and particle j in the cells around it.
+
+        ``points`` can be the particles themselves, in which case every
+        particle is paired with itself too, like the loop over all the
+        particles in ``calculate_density``, or any other sample points.
+        ``build`` must have been called with the current particle positions.
+        """
+        col, row = self.cell_coords(points)
+        first, second = [], []
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                other_col = col + d_col
+                other_row = row + d_row
+                valid = (
+                    (other_col >= 0) & (other_col < self.num_cols)
+                    & (other_row >= 0) & (other_row < self.num_rows)
+                )
+                particles = np.nonzero(valid)[0]
+                other_keys = other_row[valid] * self.num_cols + other_col[valid]
+                begin = self.cell_start[other_keys]
+                counts = self.cell_start[other_keys + 1] - begin
+                # Expand each particle into one entry per particle of the other cell
+                total = counts.sum()
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                first.append(np.repeat(particles, counts))
+                second.append(self.sorted_indices[np.repeat(begin, counts) + offsets])
+        return np.concatenate(first), np.concatenate(second)
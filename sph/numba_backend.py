@@ -0,0 +1,162 @@
+"""
+Compiled version of the SPH step, using Numba when it is installed.
+
+The density and pressure loops run over the cell list of a ``SpatialHash``
+with one particle per ``prange`` iteration, so they use all the cores without
+the big pair arrays of batched.py. Without Numba the decorators below do
+nothing and the module still imports, ``NUMBA_AVAILABLE`` tells the caller to
+pick the NumPy backend instead of running these loops in pure Python.
+"""
+import math
+
+import numpy as np
+
+from batched import MIN_DENSITY, MIN_DISTANCE, max_acceleration, resolve_collisions
+from constants import (
+    BOX_HEIGHT,
+    BOX_WIDTH,
+    MASS,
+    PRESSURE_MULTIPLIER,
+    TARGET_DENSITY,
+)
+from kernels import DEFAULT_KERNEL, Kernel
+from neighbors import SpatialHash
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# Compiled kernels are picked by number, Numba can't call the Kernel methods
+KERNEL_KINDS = {"poly6": 0, "spiky": 1, "cubic": 2}
+
+
+@njit(cache=True)
+def kernel_value(kind: int, dst: float, radius: float, factor: float) -> float:
+    if dst >= radius:
+        return 0.0
+    if kind == 0:
+        value = radius * radius - dst * dst # [m2]
+        return factor * value * value * value # [1/m2]
+    if kind == 1:
+        value = radius - dst # [m]
+        return factor * value * value * value # [1/m2]
+    q = 2.0 * dst / radius
+    if q < 1.0:
+        return factor * (1.0 - 1.5 * q * q + 0.75 * q * q * q)
+    value = 2.0 - q
+    return factor * 0.25 * value * value * value # [1/m2]
+
+
+@njit(cache=True)
+def kernel_derivative(kind: int, dst: float, radius: float, factor: float) -> float:
+    if dst >= radius:
+        return 0.0
+    if kind == 0:
+        value = radius * radius - dst * dst # [m2]
+        return factor * dst * value * value # [1/m3]
+    if kind == 1:
+        value = radius - dst # [m]
+        return factor * value * value # [1/m3]
+    q = 2.0 * dst / radius
+    if q < 1.0:
+        return factor * (-3.0 * q + 2.25 * q * q)
+    value = 2.0 - q
+    return factor * -0.75 * value * value # [1/m3]
+
+
+@njit(cache=True)
+def cell_of(x: float, y: float, origin_x: float, origin_y: float, cell_width: float, cell_height: float, num_cols: int, num_rows: int) -> tuple[int, int]:
+    col = int(math.floor((x - origin_x) / cell_width))
+    row = int(math.floor((y - origin_y) / cell_height))
+    return min(max(col, 0), num_cols - 1), min(max(row, 0), num_rows - 1)
+
+
+@njit(parallel=True, cache=True)
+def calculate_densities(positions, densities, kind, radius, factor, sorted_indices, cell_start, origin_x, origin_y, cell_width, cell_height, num_cols, num_rows):
+    for i in prange(len(positions)):
+        col, row = cell_of(positions[i, 0], positions[i, 1], origin_x, origin_y, cell_width, cell_height, num_cols, num_rows)
+        first_col = max(0, col - 1)
+        last_col = min(num_cols - 1, col + 1)
+        density = 0.0
+        for r in range(max(0, row - 1), min(num_rows, row + 2)):
+            for k in range(cell_start[r * num_cols + first_col], cell_start[r * num_cols + last_col + 1]):
+                j = sorted_indices[k]
+                dx = positions[i, 0] - positions[j, 0]
+                dy = positions[i, 1] - positions[j, 1]
+                density += MASS * kernel_value(kind, math.sqrt(dx * dx + dy * dy), radius, factor) # [kg/m2]
+        densities[i] = density
+
+
+@njit(parallel=True, cache=True)
+def calculate_pressure_forces(positions, densities, pressure_forces, kind, radius, factor, sorted_indices, cell_start, origin_x, origin_y, cell_width, cell_height, num_cols, num_rows):
+    for i in prange(len(positions)):
+        col, row = cell_of(positions[i, 0], positions[i, 1], origin_x, origin_y, cell_width, cell_height, num_cols, num_rows)
+        first_col = max(0, col - 1)
+        last_col = min(num_cols - 1, col + 1)
+        force_x = 0.0
+        force_y = 0.0
+        for r in range(max(0, row - 1), min(num_rows, row + 2)):
+            for k in range(cell_start[r * num_cols + first_col], cell_start[r * num_cols + last_col + 1]):
+                j = sorted_indices[k]
+                if j == i:
+                    continue
+                dx = positions[i, 0] - positions[j, 0]
+                dy = positions[i, 1] - positions[j, 1]
+                dst = math.sqrt(dx * dx + dy * dy) # [m]
+                if dst >= radius:
+                    continue
+                if dst > MIN_DISTANCE:
+                    direction_x = dx / dst
+                    direction_y = dy / dst
+                else:
+                    angle = 2.0 * math.pi * np.random.random()
+                    direction_x = math.cos(angle)
+                    direction_y = math.sin(angle)
+                density = max(densities[j], MIN_DENSITY) # [kg/m2]
+                slope = kernel_derivative(kind, dst, radius, factor) # [1/m3]
+                pressure_factor = PRESSURE_MULTIPLIER * (density - TARGET_DENSITY) # [kg/m2.s2]
+                magnitude = pressure_factor * slope * MASS / density
+                force_x += direction_x * magnitude
+                force_y += direction_y * magnitude
+        pressure_forces[i, 0] = force_x
+        pressure_forces[i, 1] = force_y
+
+
+def step(positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray, delta_t: float, neighbor_grid: SpatialHash | None = None, kernel: Kernel = DEFAULT_KERNEL) -> float:
+    """Same step as ``batched.step``, with the pair loops compiled.
+
+    A tabulated kernel is evaluated with its analytic formula here, the
+    compiled one is already cheaper than the table lookup.
+    """
+    kernel = getattr(kernel, "base", kernel)
+    kind = KERNEL_KINDS[kernel.name]
+    if neighbor_grid is None:
+        neighbor_grid = SpatialHash(kernel.radius, BOX_WIDTH, BOX_HEIGHT)
+    neighbor_grid.build(positions)
+    grid_args = (
+        neighbor_grid.sorted_indices,
+        neighbor_grid.cell_start,
+        neighbor_grid.origin[0],
+        neighbor_grid.origin[1],
+        neighbor_grid.cell_width,
+        neighbor_grid.cell_height,
+        neighbor_grid.num_cols,
+        neighbor_grid.num_rows,
+    )
+    calculate_densities(positions, densities, kind, kernel.radius, kernel.value_factor, *grid_args)
+    pressure_forces = np.zeros_like(positions)
+    calculate_pressure_forces(positions, densities, pressure_forces, kind, kernel.radius, kernel.derivative_factor, *grid_args)
+
+    pressure_accelerations = pressure_forces / densities[:, np.newaxis] # [m3/s2]
+    velocities += pressure_accelerations * delta_t
+    positions += velocities * delta_t
+    resolve_collisions(positions, velocities)
+    return max_acceleration(pressure_accelerations) # [m/s2]
@@ -0,0 +1,189 @@
+"""
+Domain decomposition of the SPH step over several processes.
+
+The box is split in vertical slabs, one per worker. The particle arrays live
+in ``multiprocessing.shared_memory`` blocks, so every worker sees all of them
+without copies. Each step a worker owns the particles currently inside its
+slab and reads, as halo, the ones closer than ``SMOOTHING_RADIUS`` to it,
+which is all it needs to compute their densities and forces. The step is
+split in three phases separated by barriers, because the forces need the
+densities written by the neighboring slabs and nobody can move a particle
+while others may still read it:
+
+1. densities of the owned particles
+2. pressure forces of the owned particles (kept local to the worker)
+3. integration and wall collisions of the owned particles
+
+A worker that fails aborts the barriers, so the others and the parent stop
+waiting, and ``SlabStepper.step`` raises with the exit codes of the workers.
+"""
+from multiprocessing import Array, Barrier, Process, Value
+from multiprocessing.shared_memory import SharedMemory
+from threading import BrokenBarrierError
+
+import numpy as np
+
+from batched import calculate_densities, calculate_pressure_forces, max_acceleration, resolve_collisions
+from constants import BOX_HEIGHT, BOX_WIDTH, SMOOTHING_RADIUS
+from kernels import DEFAULT_KERNEL, Kernel
+from neighbors import SpatialHash
+
+# Longest wait for the workers at a barrier [s], a step of 100k particles takes ~1 s
+STEP_TIMEOUT = 60.0
+
+
+def attach(name: str, shape: tuple[int, ...], dtype: str) -> tuple[SharedMemory, np.ndarray]:
+    memory = SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def slab_of(x: np.ndarray, num_slabs: int) -> np.ndarray:
+    slab_width = BOX_WIDTH / num_slabs
+    return np.clip(np.floor((x + 0.5 * BOX_WIDTH) / slab_width), 0, num_slabs - 1).astype(np.intp)
+
+
+def worker(slab: int, num_slabs: int, names: tuple[str, str, str], shape: tuple[int, int], dtype: str, kernel: Kernel, delta_t, stop, accelerations, start_barrier, phase_barrier, done_barrier) -> None:
+    position_memory, positions = attach(names[0], shape, dtype)
+    velocity_memory, velocities = attach(names[1], shape, dtype)
+    density_memory, densities = attach(names[2], shape[:1], dtype)
+    neighbor_grid = SpatialHash(SMOOTHING_RADIUS, BOX_WIDTH, BOX_HEIGHT)
+    slab_width = BOX_WIDTH / num_slabs
+    left = -0.5 * BOX_WIDTH + slab * slab_width
+    right = left + slab_width
+    barriers = (start_barrier, phase_barrier, done_barrier)
+
+    try:
+        while True:
+            start_barrier.wait()
+            if stop.value:
+                break
+
+            # Phase 1: densities. Particles are indexed locally inside the halo.
+            x = positions[:, 0]
+            halo = np.nonzero((x >= left - SMOOTHING_RADIUS) & (x < right + SMOOTHING_RADIUS))[0]
+            local_positions = positions[halo]
+            owned = slab_of(local_positions[:, 0], num_slabs) == slab
+            owned_local = np.nonzero(owned)[0]
+            # Only pairs starting at an owned particle, the halo ones are other workers' job
+            neighbor_grid.build(local_positions)
+            first, second = neighbor_grid.pairs(local_positions[owned_local])
+            first = owned_local[first]
+            offsets = local_positions[first] - local_positions[second]
+            close = np.einsum("ij,ij->i", offsets, offsets) < SMOOTHING_RADIUS * SMOOTHING_RADIUS
+            first, second = first[close], second[close]
+            local_densities = calculate_densities(local_positions, first, second, kernel)
+            densities[halo[owned]] = local_densities[owned]
+            phase_barrier.wait()
+
+            # Phase 2: forces, with the halo densities written by the other slabs
+            local_densities = densities[halo]
+            pressure_forces = calculate_pressure_forces(local_positions, local_densities, first, second, kernel)
+            phase_barrier.wait()
+
+            # Phase 3: move only the owned particles
+            owned_idx = halo[owned]
+            owned_velocities = velocities[owned_idx]
+            owned_accelerations = pressure_forces[owned] / local_densities[owned, np.newaxis]
+            accelerations[slab] = max_acceleration(owned_accelerations)
+            owned_velocities += owned_accelerations * delta_t.value
+            owned_positions = positions[owned_idx] + owned_velocities * delta_t.value
+            resolve_collisions(owned_positions, owned_velocities)
+            positions[owned_idx] = owned_positions
+            velocities[owned_idx] = owned_velocities
+            done_barrier.wait()
+    except BrokenBarrierError:
+        pass # another worker (or the parent) gave up, it reports why
+    except BaseException:
+        for barrier in barriers:
+            barrier.abort()
+        raise
+    finally:
+        del positions, velocities, densities
+        position_memory.close()
+        velocity_memory.close()
+        density_memory.close()
+
+
+class SlabStepper:
+    """Runs ``num_workers`` processes stepping the particles in shared memory.
+
+    ``positions``, ``velocities`` and ``densities`` are NumPy views of the
+    shared blocks, read them (or copy them) between calls to ``step``.
+    """
+
+    def __init__(self, positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray, num_workers: int, kernel: Kernel = DEFAULT_KERNEL) -> None:
+        dtype = positions.dtype
+        self.memories = [
+            SharedMemory(create=True, size=positions.nbytes),
+            SharedMemory(create=True, size=velocities.nbytes),
+            SharedMemory(create=True, size=densities.nbytes),
+        ]
+        self.positions = np.ndarray(positions.shape, dtype=dtype, buffer=self.memories[0].buf)
+        self.velocities = np.ndarray(velocities.shape, dtype=dtype, buffer=self.memories[1].buf)
+        self.densities = np.ndarray(densities.shape, dtype=dtype, buffer=self.memories[2].buf)
+        self.positions[:] = positions
+        self.velocities[:] = velocities
+        self.densities[:] = densities
+
+        self.delta_t = Value("d", 0.0, lock=False)
+        self.stop = Value("b", False, lock=False)
+        # Largest pressure acceleration of each slab in the last step
+        self.accelerations = Array("d", num_workers, lock=False)
+        # The parent takes part in the start and done barriers, only the workers in the phase one
+        self.start_barrier = Barrier(num_workers + 1)
+        self.done_barrier = Barrier(num_workers + 1)
+        self.phase_barrier = Barrier(num_workers)
+        names = tuple(memory.name for memory in self.memories)
+        self.workers = [
+            Process(
+                target=worker,
+                args=(slab, num_workers, names, positions.shape, dtype.str, kernel, self.delta_t, self.stop, self.accelerations,
+                      self.start_barrier, self.phase_barrier, self.done_barrier),
+                daemon=True,
+            )
+            for slab in range(num_workers)
+        ]
+        for process in self.workers:
+            process.start()
+
+    def step(self, delta_t: float) -> float:
+        """Advance the shared arrays by ``delta_t``, returns the largest pressure acceleration"""
+        self.delta_t.value = delta_t
+        self.wait(self.start_barrier)
+        self.wait(self.done_barrier)
+        return max(self.accelerations)
+
+    def wait(self, barrier: Barrier) -> None:
+        try:
+            barrier.wait(STEP_TIMEOUT)
+        except BrokenBarrierError:
+            # Release everyone still waiting, then report the workers that died
+            for other in (self.start_barrier, self.phase_barrier, self.done_barrier):
+                other.abort()
+            for process in self.workers:
+                process.join(1.0)
+            failed = [(slab, process.exitcode) for slab, process in enumerate(self.workers) if process.exitcode]
+            if failed:
+                raise RuntimeError(f"Slab workers failed, (slab, exit code): {failed}") from None
+            raise RuntimeError(f"Slab workers didn't finish a step in {STEP_TIMEOUT} s") from None
+
+    def close(self) -> None:
+        self.stop.value = True
+        try:
+            self.start_barrier.wait(STEP_TIMEOUT)
+        except BrokenBarrierError:
+            pass # the workers already stopped, see wait()
+        for process in self.workers:
+            process.join(STEP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        del self.positions, self.velocities, self.densities
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
+
+    def __enter__(self) -> "SlabStepper":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
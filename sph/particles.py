@@ -0,0 +1,43 @@
+"""
+Particle arrays stored as a structure of arrays.
+
+Each component (x, y and, in 3D, z) of the positions and velocities is its
+own contiguous row, in ``float64`` or ``float32``. The solver functions keep
+taking ``(N, dim)`` arrays: ``positions`` and ``velocities`` are transposed
+views of the rows, so whole-array operations write straight into them and
+reading one component (``positions[:, 0]``) walks contiguous memory.
+
+The box has no depth yet, so the 3D mode only carries a z component that
+stays at 0. It is there for data that has to match the (N, 3) layout.
+"""
+import numpy as np
+
+DTYPES = {"float32": np.float32, "float64": np.float64}
+
+
+class ParticleStore:
+    def __init__(self, num_particles: int, dim: int = 2, dtype: type = np.float64) -> None:
+        if dim not in (2, 3):
+            raise ValueError(f"dim must be 2 or 3, got {dim}")
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.position_components = np.zeros((dim, num_particles), dtype=self.dtype)
+        self.velocity_components = np.zeros((dim, num_particles), dtype=self.dtype)
+        self.densities = np.zeros(num_particles, dtype=self.dtype)
+
+    @property
+    def positions(self) -> np.ndarray:
+        """(N, dim) view of the position components"""
+        return self.position_components.T
+
+    @property
+    def velocities(self) -> np.ndarray:
+        """(N, dim) view of the velocity components"""
+        return self.velocity_components.T
+
+
+def as_points(positions: np.ndarray) -> np.ndarray:
+    """(N, 3) float64 copy of 2D or 3D positions, as VTK wants them"""
+    points = np.zeros((len(positions), 3))
+    points[:, :positions.shape[1]] = positions
+    return points
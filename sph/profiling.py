@@ -0,0 +1,72 @@
+"""
+Cheap timers for the phases of the simulation loop.
+
+    timer = PhaseTimer()
+    with timer.phase("update"):
+        update(...)
+    print(timer.summary())
+
+Each phase keeps only its last ``window`` durations, so the averages follow
+the current state of the simulation and the memory used stays constant.
+"""
+import csv
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class PhaseTimer:
+    def __init__(self, window: int = 50) -> None:
+        self.window = window
+        # dicts keep insertion order, so phases are reported in the order they run
+        self.samples: dict[str, deque[float]] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(elapsed)
+
+    def averages(self) -> dict[str, float]:
+        """Rolling average of each phase, in seconds"""
+        return {name: sum(samples) / len(samples) for name, samples in self.samples.items()}
+
+    def summary(self) -> str:
+        averages = self.averages()
+        total = sum(averages.values())
+        lines = [f"{name:<14}{1000.0 * seconds:8.2f} ms" for name, seconds in averages.items()]
+        if total > 0.0:
+            lines.append(f"{'total':<14}{1000.0 * total:8.2f} ms ({1.0 / total:.1f}/s)")
+        return "\n".join(lines)
+
+
+class StatsLog:
+    """CSV with one row of rolling averages (in ms) of ``phases`` per call to ``write``"""
+
+    def __init__(self, path: str | Path, phases: tuple[str, ...]) -> None:
+        self.phases = phases
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["step", *(f"{name}_ms" for name in phases)])
+
+    def write(self, step: int, timer: PhaseTimer) -> None:
+        # Phases that didn't run yet (e.g. the first checkpoint) are written as 0
+        averages = timer.averages()
+        self.writer.writerow([step, *(f"{1000.0 * averages.get(name, 0.0):.4f}" for name in self.phases)])
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> "StatsLog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
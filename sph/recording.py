@@ -0,0 +1,101 @@
+"""
+Frames of a headless run saved to disk and read back for replay.
+
+A run is a directory with one ``chunk_XXXXX.npz`` file per ``chunk_size``
+frames. Each chunk holds the stacked ``positions``, ``velocities`` and
+``densities`` of its frames (stored as float32) plus the ``steps`` and
+``times`` they were taken at, so a reader only needs one chunk in memory at a
+time.
+"""
+from collections.abc import Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+CHUNK_PATTERN = "chunk_*.npz"
+
+
+class Frame(NamedTuple):
+    step: int
+    time: float
+    positions: np.ndarray
+    velocities: np.ndarray
+    densities: np.ndarray
+
+
+class FrameWriter:
+    """Writes the frames of a run, see the module docstring for the layout.
+
+    A new run deletes the chunks in ``directory``. A run resumed from a
+    checkpoint at ``resume_step`` keeps the chunks up to that step and
+    appends after them.
+    """
+
+    def __init__(self, directory: str | Path, chunk_size: int = 100, compress: bool = False, resume_step: int | None = None) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.num_chunks = 0
+        for chunk_path in sorted(self.directory.glob(CHUNK_PATTERN)):
+            # Leftovers from a previous run (or from after the checkpoint) would be replayed
+            if resume_step is None or first_step(chunk_path) > resume_step:
+                chunk_path.unlink()
+            else:
+                self.num_chunks += 1
+        self.chunk_size = chunk_size
+        self.save = np.savez_compressed if compress else np.savez
+        self.frames: list[Frame] = []
+
+    def write(self, step: int, time: float, positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray) -> None:
+        frame = Frame(
+            step,
+            time,
+            positions.astype(np.float32),
+            velocities.astype(np.float32),
+            densities.astype(np.float32),
+        )
+        self.frames.append(frame)
+        if len(self.frames) == self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.frames:
+            return
+        path = self.directory / f"chunk_{self.num_chunks:05d}.npz"
+        self.save(
+            path,
+            steps=np.array([frame.step for frame in self.frames]),
+            times=np.array([frame.time for frame in self.frames]),
+            positions=np.stack([frame.positions for frame in self.frames]),
+            velocities=np.stack([frame.velocities for frame in self.frames]),
+            densities=np.stack([frame.densities for frame in self.frames]),
+        )
+        self.num_chunks += 1
+        self.frames.clear()
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "FrameWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def first_step(path: Path) -> int:
+    with np.load(path) as chunk:
+        return int(chunk["steps"][0])
+
+
+def read_frames(directory: str | Path) -> Iterator[Frame]:
+    """Yield the frames of a run in order, loading one chunk at a time"""
+    for path in sorted(Path(directory).glob(CHUNK_PATTERN)):
+        with np.load(path) as chunk:
+            steps = chunk["steps"]
+            times = chunk["times"]
+            positions = chunk["positions"]
+            velocities = chunk["velocities"]
+            densities = chunk["densities"]
+        for i in range(len(steps)):
+            yield Frame(int(steps[i]), float(times[i]), positions[i], velocities[i], densities[i])
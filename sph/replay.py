@@ -0,0 +1,61 @@
+"""
+Replay the frames written by ``main.py --headless`` in a PyVista window.
+
+    python replay.py frames --fps 24
+"""
+import argparse
+import time
+
+import pyvista as pv
+
+from constants import BOX_HEIGHT, BOX_WIDTH
+from particles import as_points
+from recording import read_frames
+
+
+def replay(directory: str, fps: float) -> None:
+    frames = read_frames(directory)
+    first = next(frames, None)
+    if first is None:
+        print(f"No frames found in {directory}")
+        return
+
+    pl = pv.Plotter()
+    box = pv.Quadrilateral(
+        [
+            [-0.5 * BOX_WIDTH, -0.5 * BOX_HEIGHT, 0.0],
+            [0.5 * BOX_WIDTH, -0.5 * BOX_HEIGHT, 0.0],
+            [0.5 * BOX_WIDTH, 0.5 * BOX_HEIGHT, 0.0],
+            [-0.5 * BOX_WIDTH, 0.5 * BOX_HEIGHT, 0.0],
+        ]
+    )
+    pl.add_mesh(box, color='white', line_width=5.0, show_edges=True, lighting=False)
+
+    # One point cloud for all the particles, its points are overwritten every frame
+    particles = pv.PolyData(as_points(first.positions))
+    particles.point_data["densities"] = first.densities
+    pl.add_mesh(particles, scalars="densities", point_size=8.0, render_points_as_spheres=True, lighting=False)
+    title = pl.add_text(f"step {first.step}  t = {first.time:.3f} s", font_size=10)
+
+    pl.view_xy()
+    pl.show(interactive_update=True)
+
+    delay = 1.0 / fps
+    for frame in frames:
+        if pl.render_window is None:
+            break
+        particles.points[:, :frame.positions.shape[1]] = frame.positions
+        particles.point_data["densities"][:] = frame.densities
+        particles.Modified()
+        title.SetText(2, f"step {frame.step}  t = {frame.time:.3f} s")
+        pl.update()
+        time.sleep(delay)
+    pl.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a headless SPH run")
+    parser.add_argument("directory", help="directory written by main.py --headless")
+    parser.add_argument("--fps", type=float, default=24.0, help="replay frame rate")
+    args = parser.parse_args()
+    replay(args.directory, args.fps)